@@ -1,10 +1,28 @@
-import threading, time, MetaTrader5 as mt5, logging
+import threading, time, logging
+from utils import latency
+import mt5_gateway
+import mt5_leverage
+import mt5_workers
+
+COMMISSION_REFRESH = 600   # seconds between commission model refreshes
 
 def panel():
+    last_refresh=time.time()
     while True:
-        pos=mt5.positions_get(); bal=mt5.account_info().balance
-        logging.info(f"Open trades: {len(pos)}, Balance: {bal}")
+        n,bal=mt5_workers.call("account_summary")
+        logging.info(f"Open trades: {n}, Balance: {bal}")
+        total=latency.summary().get("total")
+        if total:
+            logging.info(f"Signal→fill latency (n={total['n']}): p50={total['p50']:.0f}ms p95={total['p95']:.0f}ms p99={total['p99']:.0f}ms")
+        lev=mt5_leverage.stats()
+        if lev.get("misses"):
+            logging.info(f"Leverage map misses: {lev['misses']} (hits {lev.get('hits', 0)}, category {lev.get('category_hits', 0)}), top: {lev['top_missed'][:5]}")
+        mt5_gateway.log_stats()
+        if time.time()-last_refresh>=COMMISSION_REFRESH:
+            if mt5_workers.pool.running: mt5_workers.pool.broadcast("refresh_commissions")
+            else: mt5_workers.call("refresh_commissions")
+            last_refresh=time.time()
         time.sleep(30)
 
 def start():
-    t=threading.Thread(target=panel,daemon=True); t.start()
\ No newline at end of file
+    t=threading.Thread(target=panel,daemon=True); t.start()
@@ -0,0 +1,91 @@
+"""Signal-to-last-fill time for one signal on N accounts: one account after another
+vs the parallel fan-out through mt5_workers.
+
+The workers are real processes behind the real pipe protocol, but stand in for the
+terminal: each answers order_send after a latency drawn around its account's mean
+(the last account is the slow one). A zero-latency run isolates the fan-out overhead.
+With live terminals, the same numbers come from the [FANOUT] log lines.
+
+Run from the repo root:  python -m benchmarks.bench_fanout [accounts] [signals]
+"""
+import logging
+import multiprocessing
+import pathlib
+import random
+import sys
+import time
+import types
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent))
+import mt5_workers
+
+MEAN_MS = [40.0, 60.0, 80.0, 120.0, 250.0]    # per account; the last one is the slow terminal
+
+def _simulated_worker(broker: str, conn, threads: int):
+    mean = float(broker.rsplit("@", 1)[1])
+    rng = random.Random(broker)
+    conn.send(("ready", True))
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        call_id = msg[0]
+        if mean > 0:
+            time.sleep(max(rng.gauss(mean, mean * 0.2), 1.0) / 1000)
+        conn.send((call_id, True, types.SimpleNamespace(retcode=10009, comment="done"), None))
+
+def _percentiles(vals):
+    vals = sorted(vals)
+    return vals[len(vals) // 2], vals[min(int(len(vals) * 0.95), len(vals) - 1)]
+
+def _pool(means):
+    mp = multiprocessing.get_context("spawn")
+    pool = mt5_workers.WorkerPool()
+    for i, mean in enumerate(means):
+        name = f"acct{i}@{mean:g}"
+        w = pool.workers[name] = mt5_workers.BrokerWorker(name, mp, 1, target=_simulated_worker)
+        w.start()
+    for w in pool.workers.values():
+        w.ready.wait(30)
+    pool.fanout_accounts = list(pool.workers)
+    pool.active = pool.fanout_accounts[0]
+    return pool
+
+def run(means, signals):
+    pool = _pool(means)
+    try:
+        seq, fan, per_account = [], [], {a: [] for a in pool.fanout_accounts}
+        for _ in range(signals):
+            t0 = time.perf_counter()
+            for account in pool.fanout_accounts:
+                pool.workers[account].submit("send_order").result()
+            seq.append((time.perf_counter() - t0) * 1000)
+            report = pool.fanout("send_order")
+            fan.append(report.ms)
+            for account, r in report.accounts.items():
+                per_account[account].append(r["ms"])
+        return seq, fan, per_account
+    finally:
+        pool.stop()
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    signals = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    means = [MEAN_MS[i % (len(MEAN_MS) - 1)] for i in range(n - 1)] + MEAN_MS[-1:]
+    logging.disable(logging.WARNING)    # the per-account [FANOUT] lines would drown the table
+
+    print(f"{n} accounts, mean terminal latency {means} ms, {signals} signals")
+    seq, fan, per_account = run(means, signals)
+    print(f"  one after another : p50 {_percentiles(seq)[0]:7.1f} ms  p95 {_percentiles(seq)[1]:7.1f} ms  (signal to last fill)")
+    print(f"  fan-out           : p50 {_percentiles(fan)[0]:7.1f} ms  p95 {_percentiles(fan)[1]:7.1f} ms")
+    for account, vals in per_account.items():
+        print(f"    {account:<14}: p50 {_percentiles(vals)[0]:7.1f} ms")
+
+    _, fan0, _ = run([0.0] * n, signals * 4)
+    print(f"  fan-out overhead  : p50 {_percentiles(fan0)[0]:7.2f} ms  p95 {_percentiles(fan0)[1]:7.2f} ms  (zero-latency terminals)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Per-message parse cost: the old regex cascade from the_handler vs the compiled grammar.
+
+Run from the repo root:  python -m benchmarks.bench_signal_grammar [repeats]
+"""
+import pathlib
+import re
+import sys
+import time
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent))
+from utils.signal_grammar import PHRASINGS, SignalGrammar
+
+CORPUS_PATH = pathlib.Path(__file__).parent / "signal_corpus.txt"
+
+# — The cascade the_handler ran before the grammar, kept verbatim for comparison —
+trade_re = re.compile(r"(?:Ich\s+(Kaufe|Verkaufe)|I\s+(Buy|Sell))\s+([A-Za-z0-9/._]+)(?:\s+(Call|Put)(?:\s*(\d+))?)?", re.IGNORECASE)
+close_re = re.compile(r"(?:Ich\s+schließe|CLOSE)\s+([A-Za-z0-9/.]+)(?:\s+(Call|Put)(?:\s*(\d+))?)?", re.IGNORECASE)
+sl_symbol_re = re.compile(r"Ich setze den SL bei\s+([A-Za-z0-9/.]+)(?:\s+(Call|Put)(?:\s*(\d+))?)?\sauf\s([\d.]+)", re.IGNORECASE)
+tp_symbol_re = re.compile(r"(?:Ich setze den TP bei)\s+([A-Za-z0-9/.]+)(?:\s*(Call|Put))?\s*(?:\s*(\d+))?\sauf\s([\d.]+)", re.IGNORECASE)
+sl_re = re.compile(r"SL[: ]+([\d.]+)", re.IGNORECASE)
+tp_re = re.compile(r"TP[: ]+([\d.]+)", re.IGNORECASE)
+mult_re = re.compile(r"maximalen Multiplikator", re.IGNORECASE)
+put_call_re = re.compile(r"\b(call|put)\b", re.IGNORECASE)
+
+def cascade(msg):
+    mult_re.search(msg)
+    put_call_re.search(msg)
+    if m := trade_re.search(msg):
+        return "open", m.group(3)
+    if m := close_re.search(msg):
+        return "close", m.group(1)
+    sl, tp = sl_symbol_re.search(msg), tp_symbol_re.search(msg)
+    if sl or tp:
+        return "modify", (sl or tp).group(1)
+    if sl_re.search(msg) or tp_re.search(msg):
+        return "state", None
+    return "none", None
+
+def timeit(fn, corpus, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for msg in corpus:
+            fn(msg)
+    return (time.perf_counter() - start) / (repeats * len(corpus)) * 1e6
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    corpus = [l.strip() for l in CORPUS_PATH.read_text(encoding="utf-8").splitlines() if l.strip()]
+    grammar = SignalGrammar()
+
+    # Both parsers must agree on the command and symbol before timings mean anything
+    for msg in corpus:
+        sig = grammar.parse(msg)
+        kind, sym = cascade(msg)
+        assert (sig.kind, sig.symbol) == (kind, sym), f"{msg!r}: grammar={sig.kind}/{sig.symbol} cascade={kind}/{sym}"
+
+    print(f"corpus: {len(corpus)} messages x {repeats} repeats")
+    print(f"  regex cascade     : {timeit(cascade, corpus, repeats):7.2f} us/msg")
+    print(f"  compiled grammar  : {timeit(grammar.parse, corpus, repeats):7.2f} us/msg")
+
+    # Cost growth as phrasings are added: the cascade adds one search per phrasing,
+    # the grammar adds one alternative to the same pass.
+    extra = [r"wir\s+kaufen", r"we\s+buy", r"long", r"nous\s+achetons", r"compramos"]
+    for n in range(1, len(extra) + 1):
+        phrasings = {**PHRASINGS, "open_buy": PHRASINGS["open_buy"] + extra[:n]}
+        g = SignalGrammar(phrasings)
+        extra_res = [re.compile(p + r"\s+([A-Za-z0-9/._]+)", re.IGNORECASE) for p in extra[:n]]
+
+        def grown_cascade(msg, extra_res=extra_res):
+            for r in extra_res:
+                r.search(msg)
+            return cascade(msg)
+
+        print(f"  +{n} phrasings      : cascade {timeit(grown_cascade, corpus, repeats // 4):7.2f} us/msg"
+              f" | grammar {timeit(g.parse, corpus, repeats // 4):7.2f} us/msg")
+
+if __name__ == "__main__":
+    main()
@@ -13,16 +13,26 @@ import asyncio
 import logging
 
 from utils.logger import setup_logger
+from utils import config_store
 from mt5_executor import connect
-from telegram_handler import run_listener
-from admin_panel import start as start_admin
+import mt5_workers
 
 if __name__ == "__main__":
+    # Imported here, not at the top: spawned broker workers re-import this module, and
+    # telegram_handler builds the Telegram client (on the shared session file) at import
+    from telegram_handler import run_listener
+    from admin_panel import start as start_admin
+
     # initialize our logging (writes trading_bot.log, mt5_detailed.log, console)
     setup_logger()
 
-    # connect to MT5 (starts terminal, logs in)
-    if not connect():
+    # connect to MT5 (starts terminal, logs in): in process, or one warm worker per broker
+    settings = config_store.settings()
+    if settings.get("broker_workers", False) or settings.get("fanout_accounts"):
+        if not mt5_workers.pool.start():
+            logging.error("Broker workers failed to start - exiting")
+            exit(1)
+    elif not connect():
         logging.error("MT5 connection failed - exiting")
         exit(1)
 
@@ -0,0 +1,62 @@
+import time
+from mt5_gateway import mt5
+from mt5_positions import book
+
+MAX_AGE = 0.5   # seconds a fetched tick / account / position list may be reused
+
+class OrderContext:
+    """Terminal state for one signal on one symbol, fetched once and shared by
+    calc_lot, calc_incremental_margin and the send loop.
+
+    Tick and account info are re-fetched only when older than ``max_age`` seconds,
+    or after ``invalidate()`` (e.g. once an order went out); positions come from the
+    executor's position book.
+    Symbol info is contract specification and is fetched once per context.
+    """
+
+    def __init__(self, symbol: str, max_age: float = MAX_AGE):
+        self.symbol = symbol
+        self.max_age = max_age
+        self.calls = 0          # terminal calls made through this context
+        self._info = None
+        self._cache = {}        # name -> (fetched_at, value)
+
+    def _get(self, name: str, fetch):
+        hit = self._cache.get(name)
+        now = time.monotonic()
+        if hit is not None and now - hit[0] <= self.max_age:
+            return hit[1]
+        value = fetch()
+        self.calls += 1
+        self._cache[name] = (now, value)
+        return value
+
+    @property
+    def info(self):
+        if self._info is None:
+            self._info = mt5.symbol_info(self.symbol)
+            self.calls += 1
+        return self._info
+
+    @property
+    def tick(self):
+        return self._get("tick", lambda: mt5.symbol_info_tick(self.symbol))
+
+    @property
+    def account(self):
+        return self._get("account", mt5.account_info)
+
+    @property
+    def positions(self) -> tuple:
+        # Served from the position book, which is kept current without terminal calls
+        return book.positions(self.symbol)
+
+    def invalidate(self, *names):
+        """Drop cached values (all of them when no names are given)."""
+        if not names:
+            self._cache.clear()
+            self._info = None
+        for name in names:
+            if name == "info":
+                self._info = None
+            self._cache.pop(name, None)
@@ -0,0 +1,147 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from mt5_gateway import mt5
+from mt5_symbols import cache_file, save_json
+
+# — Commission model fitted from deal history —
+# Per symbol, the cost of a deal (|commission + fee|) is fitted as
+#     cost = per_lot * lots + rate * nominal
+# by least squares without intercept. The nominal is taken in account currency
+# (lots * price * tick value / tick size), so fits of symbols quoted in different
+# currencies can be pooled into the broker-wide "*" fallback. Only the sufficient statistics are kept, so new
+# deals are folded in incrementally: each refresh asks history_deals_get for the span
+# since the last deal seen and skips tickets at or below the last one. State is
+# persisted to cache/commission-<broker>.json.
+
+FORMAT = 2                  # cache files of another format (quote-currency nominals) are refitted
+HISTORY_DAYS = 90           # first fit looks this far back
+MIN_DEALS = 3               # fewer deals than this and the symbol is not trusted
+
+class _Fit:
+    __slots__ = ("n", "ll", "ln", "nn", "lc", "nc")
+
+    def __init__(self, n=0, ll=0.0, ln=0.0, nn=0.0, lc=0.0, nc=0.0):
+        self.n, self.ll, self.ln, self.nn, self.lc, self.nc = n, ll, ln, nn, lc, nc
+
+    def add(self, lots: float, nominal: float, cost: float):
+        self.n += 1
+        self.ll += lots * lots
+        self.ln += lots * nominal
+        self.nn += nominal * nominal
+        self.lc += lots * cost
+        self.nc += nominal * cost
+
+    def merge(self, other: "_Fit"):
+        for f in self.__slots__:
+            setattr(self, f, getattr(self, f) + getattr(other, f))
+
+    def coefficients(self):
+        """(per_lot, rate), both >= 0."""
+        det = self.ll * self.nn - self.ln * self.ln
+        if det > 1e-12 * max(self.ll * self.nn, 1e-300):
+            per_lot = (self.lc * self.nn - self.nc * self.ln) / det
+            rate = (self.nc * self.ll - self.lc * self.ln) / det
+            if per_lot >= 0 and rate >= 0:
+                return per_lot, rate
+        # Collinear (one price level) or a negative term: the better single-term fit
+        per_lot = self.lc / self.ll if self.ll else 0.0
+        rate = self.nc / self.nn if self.nn else 0.0
+        sse_lot = -(self.lc * per_lot)      # SSE up to a shared constant
+        sse_rate = -(self.nc * rate)
+        return (max(per_lot, 0.0), 0.0) if sse_lot <= sse_rate else (0.0, max(rate, 0.0))
+
+    def to_list(self):
+        return [self.n, self.ll, self.ln, self.nn, self.lc, self.nc]
+
+class CommissionModel:
+    def __init__(self, broker: str):
+        self.broker = broker
+        self.path = cache_file("commission", broker)
+        self.last_ticket = 0
+        self.last_time = 0          # deal time (seconds) of the newest deal folded in
+        self.fits = {}              # symbol -> _Fit
+        self.coef = {}              # symbol -> (per_lot, rate), "*" pooled over all symbols
+        self.refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.warning(f"[COMMISSION] Ignoring unreadable {self.path.name}: {e}")
+            return
+        if data.get("format") != FORMAT:
+            logging.info(f"[COMMISSION] {self.path.name} is from an older format, refitting")
+            return
+        self.last_ticket = data.get("last_ticket", 0)
+        self.last_time = data.get("last_time", 0)
+        self.fits = {sym: _Fit(*vals) for sym, vals in data.get("symbols", {}).items()}
+        self._solve()
+
+    def _save(self):
+        data = {"format": FORMAT, "last_ticket": self.last_ticket, "last_time": self.last_time,
+                "symbols": {sym: fit.to_list() for sym, fit in self.fits.items()}}
+        save_json(self.path, data, "COMMISSION")
+
+    def _solve(self):
+        coef, pooled = {}, _Fit()
+        for sym, fit in self.fits.items():
+            pooled.merge(fit)
+            if fit.n >= MIN_DEALS:
+                coef[sym] = fit.coefficients()
+        if pooled.n >= MIN_DEALS:
+            coef["*"] = pooled.coefficients()
+        self.coef = coef
+
+    def refresh(self, value_of):
+        """Fold in deals newer than the last one seen. ``value_of(symbol)`` gives the
+        account-currency value of a 1.0 price move on one lot (the current rate is
+        used for past deals too)."""
+        with self._lock:
+            since = (datetime.fromtimestamp(self.last_time) if self.last_time
+                     else datetime.now() - timedelta(days=HISTORY_DAYS))
+            deals = mt5.history_deals_get(since, datetime.now() + timedelta(days=1))
+            self.refreshed_at = time.monotonic()
+            if deals is None:
+                logging.warning(f"[COMMISSION] history_deals_get failed: {mt5.last_error()}")
+                return
+            added = 0
+            for d in deals:
+                if d.ticket <= self.last_ticket or not d.symbol or d.volume <= 0:
+                    continue
+                self.last_ticket = max(self.last_ticket, d.ticket)
+                self.last_time = max(self.last_time, int(d.time))
+                cost = abs(d.commission + getattr(d, "fee", 0.0))
+                nominal = d.volume * d.price * (value_of(d.symbol) or 1.0)
+                self.fits.setdefault(d.symbol, _Fit()).add(d.volume, nominal, cost)
+                added += 1
+            if added:
+                self._solve()
+                self._save()
+            logging.info(f"[COMMISSION] {self.broker}: +{added} deals, {len(self.coef)} fitted symbols")
+
+    def estimate(self, symbol: str, lots: float, nominal: float):
+        """Fitted commission for an order, or None when neither the symbol nor the
+        broker as a whole has enough history."""
+        c = self.coef.get(symbol) or self.coef.get("*")
+        if c is None:
+            return None
+        return c[0] * lots + c[1] * nominal
+
+_models: dict = {}
+_models_lock = threading.Lock()
+
+def model(broker: str) -> CommissionModel:
+    m = _models.get(broker)
+    if m is None:
+        with _models_lock:
+            m = _models.get(broker)
+            if m is None:
+                m = _models[broker] = CommissionModel(broker)
+    return m
@@ -4,11 +4,23 @@ import json
 import math
 import logging
 import pathlib
-import re
-import MetaTrader5 as mt5
+import threading
+from mt5_gateway import mt5
 import winsound
 import time
-from utils.symbols_alias import GROUPED_ALIASES
+import mt5_symbols
+import mt5_leverage
+from mt5_positions import book
+import mt5_health
+from mt5_health import heartbeat
+import mt5_costs
+import mt5_workers
+from mt5_context import OrderContext
+from mt5_symbols import ALIAS_TO_SYMBOL
+from utils import config_store, margin_tiers
+from utils.margin_tiers import TierSchedule
+from utils.lot_solver import max_feasible_lot, snap
+from utils.latency import NO_TRACE
 from datetime import datetime, date
 # — Global state —
 INITIAL_BALANCE: float = None
@@ -21,12 +33,12 @@ try:
     LEVERAGE_MAP = json.loads(open(LEV_PATH, encoding="utf-8").read())
 except Exception:
     LEVERAGE_MAP = {"DEFAULT": 10}
-CONFIG_PATH = BASE_DIR / "config" / "mt5_credentials.json"
-SETTINGS_PATH = BASE_DIR / "config" / "settings.json"
+CONFIG_PATH = config_store.MT5_CRED_PATH
+SETTINGS_PATH = config_store.SETTINGS_PATH
 TERMINAL_PATH = r"C:\Program Files\MetaTrader 5\terminal64.exe"
-# — Load bot settings —
+# — Load bot settings (read-only snapshot, re-read only when the file changes) —
 def load_settings() -> dict:
-    return json.load(open(SETTINGS_PATH, encoding="utf-8"))
+    return config_store.settings()
 # — Beep on errors —
 def alert_sound():
     p = BASE_DIR / "audio" / "error.wav"
@@ -37,17 +49,68 @@ def success_sound():
     winsound.PlaySound(str(p), winsound.SND_FILENAME | winsound.SND_ASYNC)
 # — Pick up active broker creds —
 def load_broker_creds() -> tuple[str, dict]:
-    data = json.load(open(CONFIG_PATH, encoding="utf-8"))
-    active = data.get("active")
+    data = config_store.broker_config()
+    active = config_store.active_broker()
     if not active or active not in data:
         alert_sound()
         raise KeyError("Active broker not set or not found in mt5_credentials.json")
     return active, data[active]
-# — Initialize / login MT5 once per run —
+# — Initialize / login MT5 once per run; the heartbeat restores the session after that —
+RECONNECT_HOLD = 5.0      # seconds a request waits for a reconnect in progress before failing
+_connect_lock = threading.RLock()
 def connect() -> bool:
     global INITIAL_BALANCE, _INITIALIZED
     if _INITIALIZED:
+        if heartbeat.up:
+            return True
+        hold = load_settings().get("reconnect_hold_ms", RECONNECT_HOLD * 1000) / 1000
+        logging.warning(f"[MT5] Terminal reconnecting, holding request up to {hold:.1f}s")
+        if heartbeat.wait_ready(hold):
+            return True
+        logging.error("[MT5] Terminal still down, request dropped")
+        return False
+    with _connect_lock:
+        if _INITIALIZED:
+            return True
+        active = _open_session()
+        if not active:
+            return False
+        _warm_caches(active)
+        # 10) Cache starting balance
+        INITIAL_BALANCE = mt5.account_info().balance
+        logging.info(f"[MT5] Base capital set to {INITIAL_BALANCE:.2f}")
+        global LAST_UPDATE_DATE
+        LAST_UPDATE_DATE = datetime.now().date()
+        _INITIALIZED = True
+    # 11) Watch the session from now on
+    heartbeat.start(reconnect, login=_expected_login())
+    return True
+def reconnect() -> bool:
+    """Heartbeat callback: log in again and re-warm the broker caches."""
+    global _risk_cache
+    with _connect_lock:
+        login = _expected_login()
+        if mt5_health.alive(login):  # Someone else (switch_broker) already brought it back
+            if login == heartbeat.login:
+                return True
+            # ... on another account: what we built belongs to the old one
+            logging.info(f"[MT5] Terminal now logged in to {login}, not {heartbeat.login}; re-warming")
+            active = config_store.active_broker()
+        else:
+            active = _open_session()
+            if not active:
+                return False
+        heartbeat.login = login
+        _warm_caches(active)
+        _risk_cache = (None, None)
         return True
+def _expected_login():
+    try:
+        return int(load_broker_creds()[1]["account_id"])
+    except Exception:
+        return None
+def _open_session():
+    """Steps 1-5: terminal up and logged in; the active broker name, or None."""
     # 1) Load which broker is active
     try:
         active, creds = load_broker_creds()
@@ -55,15 +118,16 @@ def connect() -> bool:
         logging.error(f"[MT5] {e}")
         alert_sound()
         return False
-    # 2) Verify terminal executable exists
-    if not os.path.exists(TERMINAL_PATH):
-        logging.error(f"[MT5] terminal not found: {TERMINAL_PATH}")
+    # 2) Verify terminal executable exists (a broker may have its own install, see mt5_workers)
+    terminal = creds.get("terminal_path", TERMINAL_PATH)
+    if not os.path.exists(terminal):
+        logging.error(f"[MT5] terminal not found: {terminal}")
         alert_sound()
         return False
     # 3) Kill any existing session
     mt5.shutdown()
     # 4) Initialize the MT5 terminal
-    if not mt5.initialize(path=TERMINAL_PATH):
+    if not mt5.initialize(path=terminal):
         code, msg = mt5.last_error()
         logging.error(f"[MT5] initialize() failed ({code}): {msg}")
         alert_sound()
@@ -78,17 +142,75 @@ def connect() -> bool:
         logging.error(f"[MT5] login() failed ({code}): {msg}")
         alert_sound()
         return False
+    # The terminal may be shared with another process that logs in elsewhere
+    acct = mt5.account_info()
+    if acct is None or acct.login != int(creds["account_id"]):
+        logging.error(f"[MT5] Terminal {terminal} is logged in to {getattr(acct, 'login', None)}, "
+                      f"not {creds['account_id']} ({active})")
+        alert_sound()
+        return False
     logging.info(f"[MT5] Connected to {active} ({creds['server']})")
-    # 6) Cache starting balance
-    INITIAL_BALANCE = mt5.account_info().balance
-    logging.info(f"[MT5] Base capital set to {INITIAL_BALANCE:.2f}")
-    global LAST_UPDATE_DATE
-    LAST_UPDATE_DATE = datetime.now().date()
-    _INITIALIZED = True
-    return True
+    return active
+def _warm_caches(active: str):
+    """Steps 6-9: everything built from the terminal for ``active``."""
+    # 6) Index the broker's symbols once; resolve_symbol probes this instead of scanning
+    index = mt5_symbols.build_index(active)
+    # 7) Load the position book and keep it reconciled in the background
+    book.start()
+    # 8) Warm pool: select alias and recently traded symbols and wait for live ticks
+    recent = mt5_symbols.recently_traded() | {p.symbol for p in book.positions()} | mt5_symbols.memo(active).names()
+    mt5_symbols.warm_pool.fill(mt5_symbols.warm_pool.targets(index, recent))
+    mt5_symbols.warm_pool.start()
+    # 9) Bring the commission model up to date with the deal history; compile the leverage table
+    refresh_commissions()
+    mt5_leverage.table()
 # — Symbol resolution helper —
-ALIAS_TO_SYMBOL = {alias.upper(): symbol for symbol, aliases in GROUPED_ALIASES.items() for alias in aliases + [symbol]}
+FUZZY_THRESHOLD = 0.6     # minimum trigram Dice score to accept a fuzzy symbol match
+FUZZY_BUDGET_MS = 5.0     # time allowed for the fuzzy search
 def resolve_symbol(sym: str) -> str:
+    # Memo first: (broker, text) results survive restarts and cost no terminal call
+    raw = sym.strip().upper()
+    memo = mt5_symbols.memo(config_store.active_broker() or "")
+    hit = memo.get(raw)
+    if hit is not mt5_symbols.MISS:
+        if hit is None:
+            raise ValueError(f"No symbol_info for '{sym}' (cached miss)")
+        return hit
+    try:
+        name = _resolve_uncached(sym)
+    except ValueError:
+        memo.put(raw, None)
+        raise
+    memo.put(raw, name)
+    return name
+def _resolve_uncached(sym: str) -> str:
+    index = mt5_symbols.current_index()
+    if index is not None:
+        name = index.lookup(sym)
+        if name is None:
+            # Listed after the index was built? One direct probe before giving up
+            raw = sym.strip().upper()
+            for cand in (raw.replace("/", ""), raw):
+                if mt5.symbol_info(cand):
+                    name = cand
+                    break
+        if name is None:
+            # Misspelled or decorated ("NASDQ", "Gold spot"): best trigram match if confident
+            settings = config_store.settings()
+            name, ranked = index.fuzzy_lookup(sym, settings.get("fuzzy_threshold", FUZZY_THRESHOLD),
+                                              settings.get("fuzzy_budget_ms", FUZZY_BUDGET_MS))
+            others = ", ".join(f"{n} {score:.2f} ({t})" for score, n, t in ranked)
+            if name is not None:
+                logging.warning(f"[MT5] '{sym}' fuzzy-matched to {name}; candidates: {others}")
+            else:
+                logging.warning(f"[MT5] '{sym}' not resolved; closest: {others or 'none'}")
+            mt5_symbols.log_fuzzy(index.broker, sym, name, ranked)
+        if name is None:
+            alert_sound()
+            raise ValueError(f"No symbol_info for '{sym}'")
+        index.ensure_visible(name)
+        return name
+    # No index (not connected through connect(), e.g. the dashboard): scan the terminal
     raw = sym.strip().upper()
     norm = raw.replace("/", "")
     for cand in (norm, raw):
@@ -119,6 +241,11 @@ def resolve_symbol(sym: str) -> str:
         return best.name
     alert_sound()
     raise ValueError(f"No symbol_info for '{sym}'")
+# — Lane key for the execution queue: alias-canonical name, no terminal calls —
+def symbol_key(sym: str) -> str:
+    raw = sym.strip().upper()
+    norm = raw.replace("/", "")
+    return ALIAS_TO_SYMBOL.get(norm) or ALIAS_TO_SYMBOL.get(raw) or norm
 # — Build option ticker —
 def build_option_symbol(base: str, strike: float, opt: str) -> str:
     side = "C" if opt.lower().startswith("c") else "P"
@@ -142,202 +269,193 @@ def switch_broker(new_broker: str):
         logging.error(f"[MT5] Failed to save config: {e}")
         alert_sound()
         return False
+    config_store.invalidate(CONFIG_PATH)
     logging.info(f"[MT5] Switched active broker to {new_broker}")
+    if mt5_workers.pool.running:
+        # Its worker is already logged in; only the routing changes
+        return mt5_workers.pool.switch(new_broker)
     global _INITIALIZED
     _INITIALIZED = False
     return connect()
 def search_leverage_in_map(name: str) -> float:
-    with open(CONFIG_PATH, 'r', encoding="utf-8") as f:
-        data = json.load(f)
-    active_broker = data.get("active")
-    if not active_broker:
-        logging.error("[Get leverage] No active broker")
-    active_config = data.get(active_broker)
-    if not active_config:
-        logging.error("[Get leverage] No active config")
-    name_file = active_config.get("leverage_json_file")
-    if not name_file:
-        logging.error("[Get leverage] No name file")
-    LEVERAGE_MAP_PATH = BASE_DIR / "leverage_maps" / name_file
-    if not LEVERAGE_MAP_PATH.exists():
-        logging.error("[Get leverage] Fallback LEVERAGE_MAP_PATH not exist")
-   
-    with open(LEVERAGE_MAP_PATH, 'r', encoding="utf-8") as f:
-        leverage_data = json.load(f)
-    sym = name.upper()
-    for category in leverage_data:
-        if category == "platform":
-            continue
-        items = leverage_data[category]
-        if isinstance(items, list):
-            for item in items:
-                instr = item.get("Instrument", "").upper()
-                if instr == sym:
-                    logging.detailed(f"[Get leverage] Found leverage {float(item['Leverage'])} for {sym} in {category}")
-                    return float(item["Leverage"])
-    logging.warning(f"[Get leverage] No leverage found for {sym} in map, returning None")
+    hit = mt5_leverage.table().instrument(name)
+    if hit:
+        logging.detailed(f"[Get leverage] Found leverage {hit[0]} for {name.upper()} in {hit[1]}")
+        return hit[0]
+    logging.warning(f"[Get leverage] No leverage found for {name.upper()} in map, returning None")
     return None
-def get_leverage(symbol: str) -> float:
+def get_leverage(symbol: str, explain: bool = False):
+    """Leverage used for sizing ``symbol``. With explain=True, returns the
+    mt5_leverage.Decision instead: the value plus which map entry or rule gave it."""
     sym = symbol.upper()
     logging.detailed(f"[Get leverage] Attempting to resolve symbol: {sym}")
+    decision = _leverage_decision(sym)
+    logging.detailed(f"[Get leverage] {sym}: {decision}")
+    if decision.source == "default":
+        logging.info(f"[Get leverage] No matching rules, returning default {decision.leverage} for {sym}")
+    return decision if explain else decision.leverage
+
+def _leverage_decision(sym: str) -> mt5_leverage.Decision:
     try:
         resolved_sym = resolve_symbol(sym)
-        info = mt5.symbol_info(resolved_sym)
+        # The path never changes while connected; take it from the index when we have one
+        info = mt5_symbols.info(resolved_sym)
     except ValueError as e:
         logging.error(f"[Get leverage] Failed to resolve symbol {sym}: {e}")
-        return 10.0
+        return mt5_leverage.Decision(10.0, "default", "unresolved symbol")
    
     if not info:
         logging.error(f"[Get leverage] No symbol info for {resolved_sym} after resolution, returning default 10.0")
-        return 10.0
+        return mt5_leverage.Decision(10.0, "default", "no symbol info")
    
-    with open(CONFIG_PATH, 'r', encoding="utf-8") as f:
-        data = json.load(f)
-    active = data.get("active")
+    active = config_store.active_broker()
     if not active:
         logging.error(f"[Get leverage] No active broker, returning default 10.0")
-    broker_name = active.lower()
+        return mt5_leverage.Decision(10.0, "default", "no active broker")
     value = getattr(info, "path", "")
     if isinstance(value, bytes):
         path = value.decode(errors="ignore")
     else:
         path = str(value) if value is not None else ""
-    path_norm = path.lower().strip()
-    lev = search_leverage_in_map(resolved_sym)
-    if lev:
-        logging.detailed(f"[Get leverage] Leverage from map for {resolved_sym}: {lev}")
-        return lev
-    if "stock" in path_norm:
-        return 5.0
-    else:
-        # Fallback rules
-        logging.warning("[Leverage Fallback at rules]")
-        if "metaquotes" in broker_name:
-            logging.detailed(f"[Get leverage] Metaquotes detected, returning 1.0 for {resolved_sym}")
-            return 1.0
-        standart_rules = [
-            (["fx majors"], 30.0),
-            (["fx crosses", "fx exotics"], 20.0),
-            (["xaueur","xauusd"], 20.0),
-            (["spot metals"], 10.0),
-            (["indices"], 20.0),
-            (["crypto"], 2.0),
-            (["stocks"], 5.0), # Include stocks in rules for consistency
-        ]
-        demo_rules = [
-            (["fx majors"], 500.0),
-            (["fx crosses"], 200.0),
-            (["fx exotics"], 200.0),
-            (["xaueur","xauusd"], 200.0),
-            (["spot metals"], 100.0),
-            (["metals"], 50.0),
-            (["energy"], 10.0),
-            (["indices"], 200.0),
-            (["crypto"], 20.0),
-            (["stocks"], 5.0), # Include stocks in rules for consistency
-        ]
-        pro_rules = [
-            (["fx majors"], 999.0),
-            (["fx crosses"], 500.0),
-            (["fx exotics"], 50.0),
-            (["xaueur","xauusd"], 300.0),
-            (["spot metals"], 200.0),
-            (["metals"], 20.0),
-            (["indices"], 200.0),
-            (["crypto"], 30.0),
-            (["stocks"], 5.0), # Include stocks in rules for consistency
-        ]
-        rules = standart_rules
-        segments = [s.strip() for s in re.split(r'[\\/,\;\|\-]+', path_norm) if s.strip()]
-        if "pro" in broker_name:
-            rules = pro_rules
-        if "demo" in broker_name:
-            rules = demo_rules
-        for keywords, lev_val in rules:
-            for kw in keywords:
-                for seg in segments:
-                    if (
-                        seg == kw
-                        or seg.startswith(kw + " ")
-                        or seg.startswith(kw)
-                        or seg.endswith(" " + kw)
-                        or seg.endswith(kw)
-                    ):
-                        logging.detailed(f"[Get leverage] Rule-based leverage for {resolved_sym}: {lev_val}")
-                        return lev_val
-    logging.info(f"[Get leverage] No matching rules, returning default 10.0 for {resolved_sym}")
-    return 10.0
-
-# New function for tiered margin (Libertex-specific for BTCUSD)
+    return mt5_leverage.decide(active, resolved_sym, path.strip())
+
+# Tiered margin: schedules per broker and symbol live in config/margin_tiers.json
 def calc_tiered_margin(nominal: float, tiers: list) -> float:
-    margin = 0.0
-    prev = 0.0
-    for low, high, lev in tiers:
-        if nominal <= prev:
-            break
-        segment = min(max(nominal - prev, 0), high - low)
-        margin += segment / lev
-        prev += low - prev + segment  # Update prev to end of this tier
-    return margin
+    return TierSchedule(tiers).margin(nominal)
+
+def _tier_schedule(symbol: str):
+    active, creds = load_broker_creds()
+    return margin_tiers.schedule_for(active or "", creds.get("server", "") if creds else "", symbol)
+
+def _aggregate_nominal(ctx: OrderContext, contract_size: float) -> float:
+    # Current aggregate nominal of the open positions on the symbol
+    return book.exposure(ctx.symbol)[1] * contract_size
 
-def calc_incremental_margin(symbol: str, volume: float, price: float) -> float:
+def calc_incremental_margin(symbol: str, volume: float, price: float, ctx: OrderContext = None) -> float:
+    return calc_incremental_margin_batch(symbol, [volume], price, ctx)[0]
+
+def calc_incremental_margin_batch(symbol: str, volumes, price: float, ctx: OrderContext = None) -> list:
+    """Margin each of ``volumes`` would add to the symbol's open positions."""
+    ctx = ctx or OrderContext(symbol)
     type_ = mt5.ORDER_TYPE_BUY 
     if price <= 0:
-        tick = mt5.symbol_info_tick(symbol)
+        tick = ctx.tick
         price = tick.ask if type_ == mt5.ORDER_TYPE_BUY else tick.bid 
-    info = mt5.symbol_info(symbol)
+    info = ctx.info
     if not info:
-        return 0.0
+        return [0.0 for _ in volumes]
 
-    # Detect if tiered (for Libertex BTCUSD)
-    active, creds = load_broker_creds()
-    if 'libertex' in active.lower() or 'libertex' in creds.get('server', '').lower() and symbol.upper() == 'BTCUSD':
-        # Tiers for main crypto (BTCUSD) from Libertex specs
-        tiers = [
-            (0, 50000, 200),
-            (50000, 500000, 100),
-            (500000, 1000000, 50),
-            (1000000, 5000000, 20),
-            (5000000, 10000000, 10),
-            (10000000, float('inf'), 1)
-        ]
-        # Current aggregate nominal
-        current_aggregate = 0.0
-        positions = mt5.positions_get(symbol=symbol)
-        if positions:
-            for pos in positions:
-                if pos.type in (mt5.ORDER_TYPE_BUY, mt5.ORDER_TYPE_SELL):
-                    current_aggregate += pos.volume * pos.price_open * info.trade_contract_size
-        new_aggregate = current_aggregate + volume * price * info.trade_contract_size
-        current_margin = calc_tiered_margin(current_aggregate, tiers)
-        new_margin = calc_tiered_margin(new_aggregate, tiers)
-        return new_margin - current_margin
-    else:
-        # Original logic
+    schedule = _tier_schedule(symbol)
+    if schedule:
+        contract_size = info.trade_contract_size
+        current_aggregate = _aggregate_nominal(ctx, contract_size)
+        return schedule.incremental_many(current_aggregate, [v * price * contract_size for v in volumes])
+    # Original logic
+    margins = []
+    for volume in volumes:
         margin = mt5.order_calc_margin(type_, symbol, volume, price)  
         if margin is None:
             logging.warning(f"[Margin Calc] Failed for {symbol}, volume={volume}, price={price} — using fallback")
             leverage = get_leverage(symbol) or 30
             margin = (volume * info.trade_contract_size * price) / leverage
-        return max(margin, 0.0) 
+        margins.append(max(margin, 0.0))
+    return margins
   
+# — Commission / spread buffer —
+COMMISSION_SAFETY = 1.25    # headroom over the fitted commission + current spread
+
+def refresh_commissions():
+    """Fold new deals into the active broker's commission model (connect() and the admin panel)."""
+    try:
+        mt5_costs.model(config_store.active_broker() or "").refresh(_price_value)
+    except Exception as e:
+        logging.warning(f"[COMMISSION] Refresh failed: {e}")
+
+def account_summary() -> tuple:
+    """(open positions, balance) for the admin panel."""
+    acct = mt5.account_info()
+    return len(book.positions()), acct.balance if acct else 0.0
+def commission_buffer(symbol: str, lot: float, price: float, ctx: OrderContext = None) -> float:
+    """Cash to keep free next to the margin of ``lot``: the commission fitted from this
+    broker's deal history plus the spread paid on entry, with headroom, plus the fixed
+    commission_cushion from settings. Affine in ``lot``, as the lot solver requires."""
+    ctx = ctx or OrderContext(symbol)
+    value = mt5_symbols.price_value(ctx.info)   # quote -> account currency, per lot
+    est = mt5_costs.model(config_store.active_broker() or "").estimate(symbol, lot, lot * price * value)
+    if est is None:
+        est = 0.003 * lot * price  # No deal history yet: the old 0.3% of lot * price guess
+    tick = ctx.tick
+    spread = (tick.ask - tick.bid) * value * lot if tick else 0.0
+    return COMMISSION_SAFETY * (est + spread) + config_store.settings().get("commission_cushion", 50.0)
+
+# — Portfolio stress gate (optional, "stress_gate" in settings) —
+RISK_SNAPSHOT_MAX_AGE = 1.0     # seconds a stress snapshot is reused while the book is unchanged
+_risk_cache = (None, None)      # (book version, RiskSnapshot)
+
+def _price_value(symbol: str) -> float:
+    return mt5_symbols.price_value(mt5_symbols.info(symbol))
+def _contract_size(symbol: str) -> float:
+    info = mt5_symbols.info(symbol)
+    return info.trade_contract_size if info else 1.0
+
+def _mid_price(symbol: str) -> float:
+    tick = mt5.symbol_info_tick(symbol)
+    return (tick.bid + tick.ask) / 2 if tick else 0.0
+
+def risk_snapshot(ctx: OrderContext = None):
+    """mt5_risk.RiskSnapshot of the open positions, rebuilt when the position book changes."""
+    import mt5_risk  # numpy; only loaded once the stress gate is switched on
+    global _risk_cache
+    version, snap = _risk_cache
+    if snap is not None and version == book.version and time.monotonic() - snap.built_at <= RISK_SNAPSHOT_MAX_AGE:
+        return snap
+    version = book.version
+    account = ctx.account if ctx else mt5.account_info()
+    snap = mt5_risk.build(book.positions(), account, _mid_price, _contract_size, get_leverage, _tier_schedule,
+                          _price_value)
+    _risk_cache = (version, snap)
+    return snap
+
+def _stress_gate(symbol: str, action: str, qty: float, price: float, info, settings: dict, ctx: OrderContext) -> bool:
+    """True when the worst stress scenario with the new order keeps the margin level
+    at or above stress_min_margin_level."""
+    import mt5_risk
+    t0 = time.perf_counter()
+    side = -1 if action and action.lower() == "sell" else 1
+    schedule = _tier_schedule(symbol)
+    snap = risk_snapshot(ctx).with_order(symbol, side, qty * info.trade_contract_size, price,
+                                          0.0 if schedule else get_leverage(symbol),
+                                          mt5_risk.tier_knots(schedule) if schedule else None,
+                                          mt5_symbols.price_value(info) / info.trade_contract_size)
+    result = snap.stress(settings.get("stress_moves"))
+    w = result.worst()
+    floor = settings.get("stress_min_margin_level", 100.0)
+    logging.detailed(f"[Stress] {symbol} {qty}: worst '{result.names[w]}' level {result.margin_level[w]:.0f}% "
+                     f"equity {result.equity[w]:.2f} ({(time.perf_counter() - t0) * 1000:.2f}ms)")
+    if result.margin_level[w] < floor:
+        logging.warning(f"[Stress] Rejecting {symbol} lot={qty}: '{result.names[w]}' takes margin level to "
+                        f"{result.margin_level[w]:.0f}% (< {floor}%), {result.call_distance[w]:.2f} from margin call")
+        return False
+    return True
+
 def calc_lot(symbol: str, settings: dict, balance: float, price: float,
-             start_capital: float, free_margin: float) -> float:
+             start_capital: float, free_margin: float, ctx: OrderContext = None, action: str = None) -> float:
     global INITIAL_BALANCE, LAST_UPDATE_DATE
+    ctx = ctx or OrderContext(symbol)
     current_date = datetime.now().date()
     if LAST_UPDATE_DATE is None or current_date != LAST_UPDATE_DATE:
         if not connect(): # Ensure MT5 is connected before querying balance
             return 0.0
-        INITIAL_BALANCE = mt5.account_info().balance
+        INITIAL_BALANCE = ctx.account.balance
         LAST_UPDATE_DATE = current_date
         logging.info(f"[MT5] Updated INITIAL_BALANCE to {INITIAL_BALANCE:.2f} for new day {current_date}")
-    info = mt5.symbol_info(symbol)
+    info = ctx.info
     if not info or info.trade_contract_size <= 0 or price <= 0:
         return settings.get("default_lot", 0.01)
     # 1) Determine available money
     reinvest = settings.get("reinvest", False)
     lot_method = settings.get("lot_method", "percent_start")
-    acct_info = mt5.account_info()
+    acct_info = ctx.account
     used_margin = acct_info.margin if acct_info else 0.0
     if not reinvest:
         if lot_method == 'percent_remaining':
@@ -357,15 +475,10 @@ def calc_lot(symbol: str, settings: dict, balance: float, price: float,
     # Assume contract_size from info
     contract_size = info.trade_contract_size # 1.0
     # Get current aggregate nominal (sum of open positions' nominals for this symbol)
-    aggregate_before = 0.0
-    positions = mt5.positions_get(symbol=symbol)
-    if positions:
-        for pos in positions:
-            if pos.type in (mt5.ORDER_TYPE_BUY, mt5.ORDER_TYPE_SELL): # Only open positions
-                aggregate_before += pos.volume * pos.price_open * contract_size
+    aggregate_before = _aggregate_nominal(ctx, contract_size)
     logging.detailed(f"[Aggregate Before] {aggregate_before} for symbol {symbol}")
     # НОВЕ:
-    margin_1lot = calc_incremental_margin(symbol, 1.0, price)
+    margin_1lot = calc_incremental_margin(symbol, 1.0, price, ctx)
     logging.info(f"[1Lot Margin] {margin_1lot:.2f}$ per lot")
     if margin_1lot <= 0:
         logging.error(f"[1Lot Margin ERROR] Invalid margin {margin_1lot} for {symbol} @ {price} — check price/leverage")
@@ -384,17 +497,37 @@ def calc_lot(symbol: str, settings: dict, balance: float, price: float,
     floored = math.floor(effective_lot / step) * step
     qty = max(vmin, floored) if floored >= vmin else 0.0
     logging.detailed(f"[Lot Snapping] step = {step}; vmin = {vmin}; vmax = {vmax}; effective_lot = {effective_lot}; floored = {floored}; snapped qty = {qty}")
-    # 6) Verify with actual margin calculation - all or nothing
+    # 6) Verify with actual margin calculation - shrink to the largest lot that fits
     if qty > 0:
-        expected_margin = calc_incremental_margin(symbol, qty, price)
-        expected_commission = 50.0  # Hardcoded fixed commission buffer in $
-        if expected_margin + expected_commission > free_margin:
-            logging.warning(f"[Margin Check] Expected margin {expected_margin} + comm buffer {expected_commission} > free_margin {free_margin}, rejecting")
-            qty = 0.0
+        fitted, expected_margin, samples = max_feasible_lot(
+            lambda l: calc_incremental_margin(symbol, l, price, ctx),
+            lambda l: commission_buffer(symbol, l, price, ctx),
+            qty, free_margin, step, vmin)
+        if fitted < qty:
+            logging.warning(f"[Margin Check] lot {qty} does not fit free_margin {free_margin} with comm buffer; "
+                            f"shrunk to {fitted} ({samples} margin samples)")
+            qty = fitted
         else:
+            expected_commission = commission_buffer(symbol, qty, price, ctx)
             logging.detailed(f"[Margin Check] Expected margin {expected_margin} + comm buffer {expected_commission} <= free_margin {free_margin}, proceeding")
+    # 7) Optional portfolio stress gate
+    if qty > 0 and settings.get("stress_gate", False):
+        if not _stress_gate(symbol, action, qty, price, info, settings, ctx):
+            qty = 0.0
     # ← Тут return, без відступу (вирівняний з if qty > 0)
     return round(qty, 8)
+# — Filling modes: learned per (broker, symbol), else what symbol_info allows —
+def fill_modes(symbol: str) -> tuple:
+    return mt5_symbols.fillings(config_store.active_broker() or "").order(symbol)
+
+def note_fill(symbol: str, fm: int, res):
+    if not res:
+        return
+    cache = mt5_symbols.fillings(config_store.active_broker() or "")
+    if res.retcode == 10030:
+        cache.forget(symbol, fm)
+    else:
+        cache.learn(symbol, fm)  # Any other reply means the filling mode itself was accepted
 # — Main trading function —
 def send_order(
     action: str,
@@ -405,8 +538,10 @@ def send_order(
     comment_id: str = None,
     multiplier: bool = False, #no need
     opt: str = None,
-    strike: float = None
+    strike: float = None,
+    trace=None
 ) -> object:
+    trace = trace or NO_TRACE
     if not connect():
         alert_sound()
         return fake(-9, "init failed")
@@ -414,63 +549,57 @@ def send_order(
 # if opt and strike is not None:
 # symbol = build_option_symbol(symbol, strike, opt)
     symbol = resolve_symbol(symbol)
-    mt5.symbol_select(symbol, True)
-    time.sleep(0.05) # Синхрон MT5
-    info = mt5.symbol_info(symbol)
+    mt5_symbols.warm_pool.ensure(symbol)  # No-op for warm symbols; a cold one waits for its first tick
+    settings = load_settings()
+    # One snapshot of symbol / tick / account / positions for sizing and the send loop
+    ctx = OrderContext(symbol, max_age=settings.get("order_context_max_age_ms", 500) / 1000)
+    info = ctx.info
     if not info or info.trade_mode == mt5.SYMBOL_TRADE_MODE_DISABLED:
         logging.error(f"[MT5] cannot trade {symbol}")
         alert_sound()
         return fake(-1, "disabled")
     # Market price fallback
     if price <= 0:
-        tick = mt5.symbol_info_tick(symbol)
+        tick = ctx.tick
         if not tick:
             logging.error(f"[MT5] no market tick for {symbol}")
             alert_sound()
             return fake(-3, "no price")
         price = tick.ask if action.lower() == "buy" else tick.bid
+    trace.mark("market")
     # — Multiplier lot: use use broker’s margin requirement —
-    settings = load_settings()
-    acct_info = mt5.account_info()
+    acct_info = ctx.account
     balance = acct_info.balance
     free_margin = acct_info.margin_free
     start_cap = INITIAL_BALANCE
-    lot = calc_lot(symbol, settings, balance, price, start_cap, free_margin)
+    lot = calc_lot(symbol, settings, balance, price, start_cap, free_margin, ctx, action)
+    trace.mark("calc_lot")
     logging.info(f"[DEBUG] Current free_margin: {acct_info.margin_free}, balance: {acct_info.balance}")
-    if lot > 0:
-        acct_info = mt5.account_info()
-        free_margin = acct_info.margin_free
-        expected_margin = calc_incremental_margin(symbol, lot, price)
-        expected_commission = 50.0  # Hardcoded fixed commission buffer in $
-        if expected_margin + expected_commission > free_margin:
-            logging.error(f"[MT5] Margin + comm buffer insufficient: {expected_margin + expected_commission} > {free_margin}")
-            alert_sound()
-            return fake(-10, "insufficient margin")
-
-    info = mt5.symbol_info(symbol)
     step, vmin, vmax = info.volume_step, info.volume_min, info.volume_max
+    order_type = mt5.ORDER_TYPE_BUY if action.lower()=="buy" else mt5.ORDER_TYPE_SELL
 
     original_lot = lot
     attempt = 0
-    max_attempts = 20  # Increased to 20 for more reductions to find viable size
+    max_attempts = 3  # Only a 10019 reply or a failed terminal margin check sends us round again
     while attempt < max_attempts:
         if lot <= 0:
             logging.error(f"[MT5] Lot reduced to {lot} or below min, cannot proceed")
             alert_sound()
             return fake(-10, "insufficient margin")
 
-        # Dynamic commission buffer (assume 0.3% of nominal as conservative estimate; adjust based on broker specs or testing)
-        acct_info = mt5.account_info()
-        free_margin = acct_info.margin_free
-        expected_margin = calc_incremental_margin(symbol, lot, price)
-        nominal = lot * price  # Assuming contract_size=1 for BTCUSD
-        expected_commission = 0.003 * nominal + 50  # 0.3% of nominal + fixed buffer; tune this rate (e.g., 0.001 for 0.1%, 0.005 for 0.5%)
-        if expected_margin + expected_commission > free_margin:
-            logging.warning(f"[MT5] Pre-check failed for lot={lot:.4f}: margin + comm ({expected_margin + expected_commission}) > free_margin ({free_margin}), reducing lot")
-            lot = lot * 0.8  # Reduced by 20% each time for faster convergence to viable size
-            lot = max(math.floor(lot / step) * step, vmin)
-            attempt += 1
-            continue
+        # Largest lot up to the sized one that fits free margin + commission buffer
+        free_margin = ctx.account.margin_free
+        solved, expected_margin, samples = max_feasible_lot(
+            lambda l: calc_incremental_margin(symbol, l, price, ctx),
+            lambda l: commission_buffer(symbol, l, price, ctx),
+            lot, free_margin, step, vmin)
+        if solved != lot:
+            logging.warning(f"[MT5] lot={lot:.4f} does not fit free_margin ({free_margin}); "
+                            f"largest feasible lot={solved:.4f} ({samples} margin samples)")
+            lot = solved
+            if lot <= 0:
+                continue
+        expected_commission = commission_buffer(symbol, lot, price, ctx)
 
         logging.info(f"[MT5] lot={lot:.4f} for {symbol}@{price:.4f} (attempt {attempt + 1})")
 
@@ -498,12 +627,17 @@ def send_order(
                     logging.warning(f"[MT5] Invalid TP for SELL: {tp} too close or above price {price} (min distance: {min_distance})")
                     tp = 0
 
-        actual_margin = mt5.order_calc_margin(mt5.ORDER_TYPE_BUY if action.lower()=="buy" else mt5.ORDER_TYPE_SELL, symbol, lot, price)
+        actual_margin = mt5.order_calc_margin(order_type, symbol, lot, price)
         logging.info(f"[DEBUG] ACTUAL margin from MT5: {actual_margin}")
         if actual_margin is None or actual_margin + expected_commission > free_margin:  # Added comm to this check too
             logging.warning(f"[MT5] Actual margin check failed for lot={lot:.4f}, reducing lot")
-            lot = lot * 0.8
-            lot = max(math.floor(lot / step) * step, vmin)
+            if actual_margin:
+                # Rescale by the terminal's own margin rate; the next round re-solves from there
+                fixed = commission_buffer(symbol, 0.0, price, ctx)
+                lot = snap(lot * (free_margin - fixed) / (actual_margin + expected_commission - fixed), step)
+            else:
+                lot = snap(lot * 0.8, step)
+            lot = lot if lot >= vmin else 0.0
             attempt += 1
             continue
 
@@ -512,7 +646,7 @@ def send_order(
             "action": mt5.TRADE_ACTION_DEAL,
             "symbol": symbol,
             "volume": lot,
-            "type": mt5.ORDER_TYPE_BUY if action.lower()=="buy" else mt5.ORDER_TYPE_SELL,
+            "type": order_type,
             "price": price,
             "deviation": 20,
             "magic": 234000,
@@ -527,23 +661,29 @@ def send_order(
             req["tp"] = tp
 
         success = False
-        for fm in (mt5.ORDER_FILLING_IOC, mt5.ORDER_FILLING_FOK, mt5.ORDER_FILLING_RETURN):
+        for fm in fill_modes(symbol):
             req["type_filling"] = fm
             logging.info(f"[MT5] trying fill_mode={fm}")
+            trace.mark("checks")
             res = mt5.order_send(req)
+            trace.mark("order_send")
+            note_fill(symbol, fm, res)
             if not res:
                 logging.error("[MT5] send returned None")
                 alert_sound()
                 continue
             if res.retcode == 10009:
                 logging.info(f"[MT5] Success with lot={lot:.4f} (original: {original_lot:.4f})")
+                logging.detailed(f"[MT5] {symbol}: {ctx.calls} terminal reads for sizing and checks")
+                book.opened(req, res)
                 success_sound()
                 return res
             elif res.retcode == 10019:  # No money - reduce lot and retry
-                logging.warning(f"[MT5] Failed with no money (10019), reducing lot from {lot:.4f}")
-                lot = lot * 0.8  # Consistent reduction
-                lot = max(math.floor(lot / step) * step, vmin)
+                logging.warning(f"[MT5] Failed with no money (10019), re-solving lot from {lot:.4f}")
+                lot = snap(lot - step, step)  # The solver starts strictly below the rejected size
+                lot = lot if lot >= vmin else 0.0
                 attempt += 1
+                ctx.invalidate("account")  # The terminal disagrees with our margin view - re-read it
                 break  # Exit fill_mode loop to retry with smaller lot
             elif res.retcode == 10018:  # Market closed - stop attempts
                 logging.error(f"[MT5] Market closed for {symbol}")
@@ -561,7 +701,135 @@ def send_order(
     alert_sound()
     return fake(10030, "all fill modes unsupported or failed")
 # — Close positions —
-def close_pos(symbol: str) -> object:
+class BatchReport:
+    """Outcome of a bulk close or modify: one entry per ticket and the wall-clock time.
+    Carries retcode/comment like an order_send result, so single-result callers work."""
+
+    def __init__(self):
+        self.results = []   # {"ticket", "symbol", "volume", "via", "retcode", "comment", "ms", ...}
+        self.ms = 0.0
+
+    def add(self, p, volume: float, via: str, res, ms: float, **extra):
+        self.results.append({"ticket": p.ticket, "symbol": p.symbol, "volume": volume, "via": via,
+                             "retcode": res.retcode if res else -2,
+                             "comment": res.comment if res else "none", "ms": round(ms, 2), **extra})
+
+    @property
+    def failed(self) -> list:
+        return [r for r in self.results if r["retcode"] != mt5.TRADE_RETCODE_DONE]
+
+    @property
+    def retcode(self) -> int:
+        failed = self.failed
+        return failed[0]["retcode"] if failed else mt5.TRADE_RETCODE_DONE
+
+    @property
+    def comment(self) -> str:
+        failed = self.failed
+        if failed:
+            return f"{len(failed)}/{len(self.results)} failed: {failed[0]['comment']}"
+        return f"{len(self.results)} tickets done"
+
+def _can_close_by(symbol: str) -> bool:
+    if book.netting:
+        return False
+    info = mt5_symbols.info(symbol)
+    return bool(info) and bool(getattr(info, "order_mode", 0) & mt5.SYMBOL_ORDER_CLOSEBY)
+
+def _close_deal(p, volume: float, tick, report: BatchReport, trace):
+    opp = mt5.ORDER_TYPE_SELL if p.type==mt5.ORDER_TYPE_BUY else mt5.ORDER_TYPE_BUY
+    price = tick.bid if opp==mt5.ORDER_TYPE_SELL else tick.ask
+    req = {
+        "action": mt5.TRADE_ACTION_DEAL,
+        "position": p.ticket,
+        "symbol": p.symbol,
+        "volume": volume,
+        "type": opp,
+        "price": price,
+        "deviation": 20,
+        "magic": p.magic,
+        "comment": "Close",
+        "type_time": mt5.ORDER_TIME_GTC
+    }
+    t0 = time.perf_counter()
+    res = None
+    for fm in fill_modes(p.symbol):
+        req["type_filling"] = fm
+        trace.mark("checks")
+        res = mt5.order_send(req)
+        trace.mark("order_send")
+        note_fill(p.symbol, fm, res)
+        if res and res.retcode != 10030:
+            break
+    if res and res.retcode == mt5.TRADE_RETCODE_DONE:
+        book.closed(p.ticket, volume)
+    report.add(p, volume, "deal", res, (time.perf_counter() - t0) * 1000)
+
+def _close_symbol(symbol: str, positions, report: BatchReport, trace):
+    # Net opposite tickets against each other first: one request closes both sides
+    # without paying the spread twice
+    left = {p.ticket: [p, p.volume] for p in positions}
+    if _can_close_by(symbol):
+        buys = [p.ticket for p in positions if p.type == mt5.ORDER_TYPE_BUY]
+        sells = [p.ticket for p in positions if p.type == mt5.ORDER_TYPE_SELL]
+        while buys and sells:
+            b, s = left[buys[0]], left[sells[0]]
+            req = {"action": mt5.TRADE_ACTION_CLOSE_BY, "position": b[0].ticket,
+                   "position_by": s[0].ticket, "magic": b[0].magic, "comment": "CloseBy"}
+            t0 = time.perf_counter()
+            trace.mark("checks")
+            res = mt5.order_send(req)
+            trace.mark("order_send")
+            ms = (time.perf_counter() - t0) * 1000
+            if not res or res.retcode != mt5.TRADE_RETCODE_DONE:
+                logging.warning(f"[MT5] close_by {b[0].ticket}/{s[0].ticket} failed: "
+                                f"{res.retcode if res else None}, closing by deals")
+                break
+            v = round(min(b[1], s[1]), 8)
+            for side, entry in ((buys, b), (sells, s)):
+                report.add(entry[0], v, "close_by", res, ms)
+                book.closed(entry[0].ticket, v)
+                entry[1] = round(entry[1] - v, 8)
+                if entry[1] <= 0:
+                    del left[entry[0].ticket]
+                    side.pop(0)
+    if not left:
+        return
+    tick = mt5.symbol_info_tick(symbol)  # One tick for every ticket on the symbol
+    if not tick:
+        logging.error(f"[MT5] no tick for {symbol}")
+        alert_sound()
+        for p, volume in left.values():
+            report.add(p, volume, "deal", fake(-3, "no price"), 0.0)
+        return
+    for p, volume in left.values():
+        _close_deal(p, volume, tick, report, trace)
+
+def close_all(symbol: str = None, trace=None) -> BatchReport:
+    """Close every open ticket on ``symbol`` (a broker symbol), or on the whole account
+    when ``symbol`` is None. Returns per-ticket results and the time to flat."""
+    trace = trace or NO_TRACE
+    report = BatchReport()
+    t0 = time.perf_counter()
+    by_symbol = {}
+    for p in book.positions(symbol):
+        by_symbol.setdefault(p.symbol, []).append(p)
+    for sym, positions in by_symbol.items():
+        _close_symbol(sym, positions, report, trace)
+    report.ms = (time.perf_counter() - t0) * 1000
+    failed = report.failed
+    logging.info(f"[MT5] Closed {len(report.results) - len(failed)}/{len(report.results)} tickets on "
+                 f"{symbol or 'all symbols'} in {report.ms:.0f}ms")
+    for r in failed:
+        logging.error(f"[MT5] close {r['ticket']} {r['symbol']} failed: {r['retcode']} {r['comment']}")
+    if failed:
+        alert_sound()
+    elif report.results:
+        success_sound()
+    return report
+
+def close_pos(symbol: str, trace=None) -> object:
+    trace = trace or NO_TRACE
     if not connect():
         alert_sound()
         return fake(-9, "init failed")
@@ -574,67 +842,87 @@ def close_pos(symbol: str) -> object:
         alert_sound()
         return fake(-1, "no symbol")
    
-    pos_list = mt5.positions_get(symbol=symbol) or []
-    if not pos_list:
+    if not book.positions(symbol):
         logging.error(f"[MT5] no pos for {symbol}")
         alert_sound()
         return fake(-4, "none")
-    for p in pos_list:
-        opp = mt5.ORDER_TYPE_SELL if p.type==mt5.ORDER_TYPE_BUY else mt5.ORDER_TYPE_BUY
-        tick = mt5.symbol_info_tick(p.symbol)
-        if not tick:
-            logging.error(f"[MT5] no tick for {p.symbol}")
-            alert_sound()
-            continue
-        price = tick.bid if opp==mt5.ORDER_TYPE_SELL else tick.ask
-        req = {
-            "action": mt5.TRADE_ACTION_DEAL,
-            "position": p.ticket,
-            "symbol": p.symbol,
-            "volume": p.volume,
-            "type": opp,
-            "price": price,
-            "deviation": 20,
-            "magic": p.magic,
-            "comment": "Close",
-            "type_time": mt5.ORDER_TIME_GTC
-        }
-        for fm in (mt5.ORDER_FILLING_IOC, mt5.ORDER_FILLING_FOK, mt5.ORDER_FILLING_RETURN):
-            req["type_filling"] = fm
-            res = mt5.order_send(req)
-            if res and res.retcode != 10030:
-                success_sound()
-                return res
-    return fake(10030, "none")
-# — Modify existing position —
-def modify_position(ticket: int, sl: float = None, tp: float = None) -> object:
+    return close_all(symbol, trace)
+
+def flatten(trace=None) -> object:
+    """Emergency: close every position on the account."""
     if not connect():
         alert_sound()
         return fake(-9, "init failed")
-    pl = mt5.positions_get(ticket=ticket) or []
-    if not pl:
-        logging.error(f"[MT5] no ticket {ticket}")
-        alert_sound()
-        return fake(-4, "none")
-    p = pl[0]
+    return close_all(None, trace)
+# — Modify existing position —
+def _price_format(symbol: str):
+    """(digits, point) for normalizing SL/TP prices."""
+    info = mt5_symbols.info(symbol)
+    return (info.digits, info.point) if info else (8, 1e-8)
+
+def _modify_ticket(p, sl, tp, report: BatchReport, trace, digits: int, point: float):
+    """One TRADE_ACTION_SLTP for position ``p``, or none when it is already there.
+    A level that is None keeps the position's current value: an SLTP request without
+    it would reset it to 0."""
+    new_sl = p.sl if sl is None else round(sl, digits)
+    new_tp = p.tp if tp is None else round(tp, digits)
+    if abs(new_sl - p.sl) < point / 2 and abs(new_tp - p.tp) < point / 2:
+        report.add(p, p.volume, "unchanged", fake(mt5.TRADE_RETCODE_DONE, "no change"), 0.0, sl=new_sl, tp=new_tp)
+        return
     req = {
         "action": mt5.TRADE_ACTION_SLTP,
-        "position": ticket,
+        "position": p.ticket,
         "symbol": p.symbol,
+        "sl": new_sl,
+        "tp": new_tp,
         "type_time": mt5.ORDER_TIME_GTC
     }
-    if sl is not None: req["sl"] = sl
-    if tp is not None: req["tp"] = tp
-    logging.info(f"[MT5] modify ticket={ticket} SL={sl} TP={tp}")
+    logging.info(f"[MT5] modify ticket={p.ticket} SL={p.sl}→{new_sl} TP={p.tp}→{new_tp}")
+    t0 = time.perf_counter()
+    trace.mark("checks")
     res = mt5.order_send(req)
-    if not res:
-        logging.error("[MT5] modify returned None")
+    trace.mark("order_send")
+    if res and res.retcode == mt5.TRADE_RETCODE_DONE:
+        book.modified(p.ticket, new_sl, new_tp)
+    report.add(p, p.volume, "sltp", res, (time.perf_counter() - t0) * 1000, sl=new_sl, tp=new_tp)
+
+def modify_many(positions, sl: float = None, tp: float = None, trace=None) -> BatchReport:
+    """Set SL and/or TP on every position given; tickets already at the target are
+    skipped, and a failure on one ticket does not stop the others."""
+    trace = trace or NO_TRACE
+    report = BatchReport()
+    t0 = time.perf_counter()
+    formats = {}
+    for p in positions:
+        if p.symbol not in formats:
+            formats[p.symbol] = _price_format(p.symbol)
+        _modify_ticket(p, sl, tp, report, trace, *formats[p.symbol])
+    report.ms = (time.perf_counter() - t0) * 1000
+    failed = report.failed
+    sent = sum(1 for r in report.results if r["via"] == "sltp")
+    logging.info(f"[MT5] SL/TP on {len(report.results)} tickets: {sent} sent, "
+                 f"{len(report.results) - sent} unchanged, {len(failed)} failed in {report.ms:.0f}ms")
+    for r in failed:
+        logging.error(f"[MT5] modify {r['ticket']} {r['symbol']} failed: {r['retcode']} {r['comment']}")
+    if failed:
+        alert_sound()
+    elif sent:
+        success_sound()
+    return report
+
+def modify_position(ticket: int, sl: float = None, tp: float = None) -> object:
+    if not connect():
+        alert_sound()
+        return fake(-9, "init failed")
+    p = book.get(ticket)
+    if not p:
+        logging.error(f"[MT5] no ticket {ticket}")
         alert_sound()
-        return fake(-5, "none")
-    success_sound()
-    return res
+        return fake(-4, "none")
+    return modify_many([p], sl, tp)
 # — Modify existing position by symbol (new function for setting SL/TP on trades by symbol) —
-def modify_by_symbol(symbol: str, sl: float = 0.0, tp: float = 0.0) -> object:
+def modify_by_symbol(symbol: str, sl: float = None, tp: float = None, trace=None) -> object:
+    trace = trace or NO_TRACE
     if not connect():
         alert_sound()
         return fake(-9, "init failed")
@@ -645,42 +933,22 @@ def modify_by_symbol(symbol: str, sl: float = 0.0, tp: float = 0.0) -> object:
         alert_sound()
         return fake(-1, "no symbol")
    
-    pl = mt5.positions_get(symbol=symbol) or []
+    pl = book.positions(symbol)
     if not pl:
         logging.error(f"[MT5] no pos for {symbol}")
         alert_sound()
         return fake(-4, "none")
-   
-    # Assuming multiple positions possible, modify all
-    for p in pl:
-        req = {
-            "action": mt5.TRADE_ACTION_SLTP,
-            "position": p.ticket,
-            "symbol": p.symbol,
-            "type_time": mt5.ORDER_TIME_GTC
-        }
-        if sl is not None: req["sl"] = sl
-        if tp is not None: req["tp"] = tp
-        logging.info(f"[MT5] modify ticket={p.ticket} SL={sl} TP={tp}")
-        res = mt5.order_send(req)
-        if not res:
-            logging.error("[MT5] modify returned None")
-            alert_sound()
-            return fake(-5, "none")
-        success_sound()
-        # If multiple, could collect results, but for simplicity return last
-    return res
+    return modify_many(pl, sl, tp, trace)
 # — Close by ticket ID —
 def close_pos_by_ticket(ticket: int) -> object:
     if not connect():
         alert_sound()
         return fake(-9, "init failed")
-    pl = mt5.positions_get(ticket=ticket) or []
-    if not pl:
+    p = book.get(ticket)
+    if not p:
         logging.error(f"[MT5] no ticket {ticket}")
         alert_sound()
         return fake(-4, "none")
-    p = pl[0]
     opp = mt5.ORDER_TYPE_SELL if p.type==mt5.ORDER_TYPE_BUY else mt5.ORDER_TYPE_BUY
     tick = mt5.symbol_info_tick(p.symbol)
     if not tick:
@@ -700,16 +968,19 @@ def close_pos_by_ticket(ticket: int) -> object:
         "comment": "Close",
         "type_time": mt5.ORDER_TIME_GTC
     }
-    for fm in (mt5.ORDER_FILLING_IOC, mt5.ORDER_FILLING_FOK, mt5.ORDER_FILLING_RETURN):
+    for fm in fill_modes(p.symbol):
         req["type_filling"] = fm
         logging.detailed(f"[MT5] trying fill_mode={fm}")
         res = mt5.order_send(req)
+        note_fill(p.symbol, fm, res)
         if not res:
             logging.error("[MT5] send returned None")
             alert_sound()
             return fake(-2, "none")
         if res.retcode != 10030:
             logging.debug(f"[MT5] result {res.retcode} {res.comment}")
+            if res.retcode == 10009:
+                book.closed(p.ticket, p.volume)
             success_sound()
             return res
         logging.warning(f"[MT5] unsupported fill_mode={fm}")
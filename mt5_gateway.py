@@ -0,0 +1,123 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+import MetaTrader5 as _mt5
+
+# — MT5 gateway —
+# The MetaTrader5 module is not safe to call from several threads at once, and the
+# executor's worker threads, the position book, the warm pool and the admin panel all
+# use it. One gateway thread owns the terminal: every call is queued as a request and
+# answered through a future. Requests that arrive together are taken as one batch;
+# within a batch, identical reads (same function and arguments) between two writes are
+# made once and share the result.
+#
+# ``mt5`` below is a drop-in for the module: constants come straight from MetaTrader5,
+# functions are routed through the gateway.
+
+BATCH_MAX = 64
+
+# Calls that do not change terminal state; everything else is treated as a write.
+# last_error() is not among them: it reports on the caller's previous call.
+READS = frozenset({
+    "account_info", "terminal_info", "version",
+    "symbols_total", "symbols_get", "symbol_info", "symbol_info_tick",
+    "positions_total", "positions_get", "orders_total", "orders_get",
+    "history_orders_total", "history_orders_get", "history_deals_total", "history_deals_get",
+    "order_calc_margin", "order_calc_profit", "copy_ticks_from", "copy_rates_from_pos",
+})
+
+class Gateway:
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.stats = {"calls": 0, "batches": 0, "deduped": 0, "max_batch": 0}
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True, name="mt5-gateway")
+                    self._thread.start()
+
+    def submit(self, name: str, *args, **kwargs) -> Future:
+        """Queue ``MetaTrader5.<name>(*args, **kwargs)``; returns its future."""
+        fut = Future()
+        if threading.current_thread() is self._thread:
+            # Already on the gateway (e.g. a call made while serving another): run inline
+            self._call(name, args, kwargs, fut)
+            return fut
+        self._ensure_started()
+        self._queue.put((name, args, kwargs, fut))
+        return fut
+
+    def call(self, name: str, *args, **kwargs):
+        return self.submit(name, *args, **kwargs).result()
+
+    def _call(self, name, args, kwargs, fut):
+        self.stats["calls"] += 1
+        try:
+            fut.set_result(getattr(_mt5, name)(*args, **kwargs))
+        except Exception as e:
+            fut.set_exception(e)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < BATCH_MAX:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.stats["batches"] += 1
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+            seen = {}           # read key -> future holding its result, until the next write
+            for name, args, kwargs, fut in batch:
+                if name not in READS:
+                    seen.clear()
+                    self._call(name, args, kwargs, fut)
+                    continue
+                try:
+                    key = (name, args, tuple(sorted(kwargs.items())))
+                    hash(key)
+                except TypeError:
+                    self._call(name, args, kwargs, fut)
+                    continue
+                done = seen.get(key)
+                if done is None:
+                    self._call(name, args, kwargs, fut)
+                    seen[key] = fut
+                    continue
+                self.stats["deduped"] += 1
+                if done.exception() is not None:
+                    fut.set_exception(done.exception())
+                else:
+                    fut.set_result(done.result())
+
+gateway = Gateway()
+
+class _Module:
+    """Stand-in for ``import MetaTrader5 as mt5`` that routes calls via the gateway."""
+
+    def __init__(self):
+        self._wrapped = {}
+
+    def __getattr__(self, name):
+        attr = getattr(_mt5, name)
+        if not callable(attr) or isinstance(attr, type):
+            return attr
+        fn = self._wrapped.get(name)
+        if fn is None:
+            def fn(*args, _name=name, **kwargs):
+                return gateway.call(_name, *args, **kwargs)
+            fn.__name__ = name
+            self._wrapped[name] = fn
+        return fn
+
+mt5 = _Module()
+
+def log_stats():
+    s = gateway.stats
+    logging.detailed(f"[GATEWAY] {s['calls']} terminal calls in {s['batches']} batches "
+                     f"(max {s['max_batch']}), {s['deduped']} reads deduped")
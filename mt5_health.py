@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+from mt5_gateway import mt5
+
+# — Terminal heartbeat —
+# Once connect() has succeeded, a daemon thread checks every HEARTBEAT_INTERVAL that the
+# terminal is still linked to the broker (terminal_info().connected) and that it is
+# still logged in to our account (another process logging the terminal in elsewhere
+# counts as a lost session). A failed check marks the session down and calls ``reconnect`` with
+# exponential backoff until it succeeds. Callers that need the terminal wait on
+# ``wait_ready`` instead of failing straight away while a reconnect is in progress.
+
+HEARTBEAT_INTERVAL = 2.0
+BACKOFF_MIN = 0.5
+BACKOFF_MAX = 30.0
+FAILS_TO_DROP = 2           # consecutive failed checks before the session counts as dead
+
+def alive(login: int = None) -> bool:
+    """Terminal linked to the broker and logged in (to ``login``, when given)."""
+    ti = mt5.terminal_info()
+    if not ti or not ti.connected:
+        return False
+    acct = mt5.account_info()
+    return acct is not None and (login is None or acct.login == login)
+
+class Heartbeat:
+    def __init__(self):
+        self._up = threading.Event()
+        self._reconnect = None
+        self.login = None           # account the session must stay logged in to
+        self._thread = None
+        self._stop = threading.Event()
+        self.down_since = None
+        self.stats = {"checks": 0, "outages": 0, "reconnects": 0, "last_outage_s": 0.0}
+
+    @property
+    def up(self) -> bool:
+        return self._up.is_set()
+
+    def wait_ready(self, timeout: float) -> bool:
+        """True once the session is up, waiting at most ``timeout`` seconds for it."""
+        return self._up.wait(timeout)
+
+    def start(self, reconnect, login: int = None, interval: float = HEARTBEAT_INTERVAL):
+        """Mark the session up; ``reconnect()`` -> bool is called when it drops or
+        the terminal ends up logged in to another account than ``login``."""
+        self._reconnect = reconnect
+        self.login = login
+        self.down_since = None
+        self._up.set()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True, name="heartbeat")
+            self._thread.start()
+
+    def _run(self, interval: float):
+        fails = 0
+        while not self._stop.wait(interval):
+            self.stats["checks"] += 1
+            try:
+                ok = alive(self.login)
+            except Exception as e:
+                logging.warning(f"[HEARTBEAT] Check failed: {e}")
+                ok = False
+            if ok:
+                fails = 0
+                continue
+            fails += 1
+            if fails >= FAILS_TO_DROP:
+                self._recover()
+                fails = 0
+
+    def _recover(self):
+        self._up.clear()
+        self.down_since = time.monotonic()
+        self.stats["outages"] += 1
+        logging.error(f"[HEARTBEAT] Terminal session lost: {mt5.last_error()}; reconnecting")
+        delay = BACKOFF_MIN
+        while not self._stop.is_set():
+            try:
+                ok = self._reconnect()
+            except Exception as e:
+                logging.error(f"[HEARTBEAT] Reconnect raised: {e}")
+                ok = False
+            if ok:
+                break
+            logging.warning(f"[HEARTBEAT] Reconnect failed, next attempt in {delay:.1f}s")
+            self._stop.wait(delay)
+            delay = min(delay * 2, BACKOFF_MAX)
+        if self._stop.is_set():
+            return
+        outage = time.monotonic() - self.down_since
+        self.stats["reconnects"] += 1
+        self.stats["last_outage_s"] = round(outage, 2)
+        self.down_since = None
+        self._up.set()
+        logging.info(f"[HEARTBEAT] Session restored after {outage:.1f}s")
+
+heartbeat = Heartbeat()
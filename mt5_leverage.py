@@ -0,0 +1,241 @@
+import logging
+import re
+import threading
+from collections import Counter
+from typing import NamedTuple
+from utils import config_store
+
+# — Compiled leverage tables —
+# A leverage map (leverage_maps/*.json) is a dict of categories: most are lists of
+# {"Instrument", "Leverage"}, a few are plain numbers ("Stocks": 5) that give the
+# leverage of any symbol in that category the list does not name. Each map is
+# compiled once into an upper-case instrument -> leverage dict plus a category ->
+# default dict, and recompiled only when the file snapshot or the active broker changes.
+
+class LeverageTable:
+    def __init__(self, broker: str, file_name: str, data):
+        self.broker = broker
+        self.file_name = file_name
+        self.platform = data.get("platform", "")
+        self.instruments = {}   # INSTRUMENT -> (leverage, category)
+        self.defaults = {}      # category stem ("stock") -> (leverage, category)
+        for category, items in data.items():
+            if category == "platform":
+                continue
+            if isinstance(items, (int, float)) and not isinstance(items, bool):
+                self.defaults[category.lower().rstrip("s")] = (float(items), category)
+            elif isinstance(items, (list, tuple)):
+                for item in items:
+                    instr = str(item.get("Instrument", "")).upper()
+                    if instr and "Leverage" in item:
+                        # First entry wins, as in the old linear scan
+                        self.instruments.setdefault(instr, (float(item["Leverage"]), category))
+
+    def __len__(self):
+        return len(self.instruments)
+
+    def instrument(self, name: str):
+        """(leverage, category) listed for ``name``, or None."""
+        return self.instruments.get(name.upper())
+
+    def category_default(self, path: str):
+        """(leverage, category) of a category default whose name appears in the
+        symbol's MT5 path ("Stocks\\US\\AAPL" -> "Stocks": 5), or None."""
+        path = path.lower()
+        for stem, hit in self.defaults.items():
+            if stem and stem in path:
+                return hit
+        return None
+
+EMPTY = LeverageTable("", "", {})
+
+_table: LeverageTable = EMPTY
+_source = (None, None, None)    # (broker, file name, snapshot) _table was compiled from
+_lock = threading.Lock()
+_stats = Counter()              # hits, category_hits, misses, reloads
+_missed = Counter()             # symbol -> misses
+
+def _active():
+    data = config_store.broker_config()
+    broker = config_store.active_broker()
+    if not broker:
+        logging.error("[Get leverage] No active broker")
+        return None, None
+    cfg = data.get(broker)
+    if not cfg:
+        logging.error("[Get leverage] No active config")
+        return broker, None
+    file_name = cfg.get("leverage_json_file")
+    if not file_name:
+        logging.error("[Get leverage] No name file")
+    return broker, file_name
+
+def table() -> LeverageTable:
+    """Table for the active broker. One stat() per config file when nothing changed."""
+    global _table, _source
+    broker, file_name = _active()
+    if not file_name:
+        return EMPTY
+    try:
+        data = config_store.leverage_map(file_name)
+    except FileNotFoundError:
+        logging.error(f"[Get leverage] Leverage map {file_name} does not exist")
+        return EMPTY
+    except ValueError as e:
+        logging.error(f"[Get leverage] Leverage map {file_name} is not valid JSON: {e}")
+        return EMPTY
+    src = _source
+    if src[0] == broker and src[1] == file_name and src[2] is data:
+        return _table
+    with _lock:
+        if _source[0] == broker and _source[1] == file_name and _source[2] is data:
+            return _table
+        compiled = LeverageTable(broker, file_name, data)
+        # Swap table and source together; readers see either the old pair or the new one
+        _table, _source = compiled, (broker, file_name, data)
+        _stats["reloads"] += 1
+        logging.info(f"[Get leverage] Compiled {file_name} for {broker}: "
+                     f"{len(compiled)} instruments, {len(compiled.defaults)} category defaults")
+        return compiled
+
+def lookup(name: str, path: str = ""):
+    """Leverage for a broker symbol from the active map: the instrument entry, else a
+    category default matching ``path``, else None (counted as a miss)."""
+    d = _from_map(name, path)
+    return d.leverage if d else None
+
+def _from_map(name: str, path: str):
+    t = table()
+    hit = t.instrument(name)
+    if hit:
+        _stats["hits"] += 1
+        return Decision(hit[0], "map", f"{t.file_name} {hit[1]}")
+    hit = t.category_default(path) if path else None
+    if hit:
+        _stats["category_hits"] += 1
+        return Decision(hit[0], "category", f"{t.file_name} {hit[1]}")
+    _stats["misses"] += 1
+    _missed[name.upper()] += 1
+    return None
+
+def stats() -> dict:
+    """Lookup counters plus the most missed symbols, for the admin panel / dashboard."""
+    t = _table
+    return {**_stats, "broker": t.broker, "file": t.file_name, "instruments": len(t),
+            "top_missed": _missed.most_common(10)}
+
+# — Fallback rules for symbols the map does not list —
+# config/leverage_rules.json holds named rule sets. A rule is a list of keywords and a
+# leverage; it fires when a segment of the symbol's MT5 path ("Forex\\FX Majors\\EURUSD")
+# starts or ends with one of its keywords, and the first rule in the set that fires
+# wins. A broker uses the set named by "leverage_rules" in its mt5_credentials.json
+# entry, else the first "select" entry whose text is in its name, else "default".
+
+_SEGMENT_SPLIT = re.compile(r"[\\/,;|\-]+")
+
+class Decision(NamedTuple):
+    leverage: float
+    source: str         # map, category, stock path, flat, rule, default
+    detail: str = ""
+
+    def __str__(self):
+        return f"{self.leverage} from {self.source}" + (f" ({self.detail})" if self.detail else "")
+
+def segments(path: str) -> list:
+    return [s.strip() for s in _SEGMENT_SPLIT.split(path.lower()) if s.strip()]
+
+class RuleSet:
+    """One rule set compiled to keyword -> rule index, so matching a segment is a
+    dictionary probe per keyword length at each end of the segment."""
+
+    def __init__(self, name: str, spec):
+        self.name = name
+        self.flat = float(spec["flat"]) if spec.get("flat") is not None else None
+        self.rules = [(tuple(kw.lower() for kw in r["match"]), float(r["leverage"])) for r in spec.get("rules", ())]
+        self.keywords = {}
+        for i, (kws, _) in enumerate(self.rules):
+            for kw in kws:
+                self.keywords.setdefault(kw, i)
+        self.lengths = sorted({len(kw) for kw in self.keywords})
+
+    def match(self, segs):
+        """(rule index, keyword, segment) of the first rule that fires, or None."""
+        best = None
+        for seg in segs:
+            for n in self.lengths:
+                if n > len(seg):
+                    break
+                for kw in (seg[:n], seg[-n:]):
+                    i = self.keywords.get(kw)
+                    if i is not None and (best is None or i < best[0]):
+                        best = (i, kw, seg)
+        return best
+
+_rules = {}                     # set name -> RuleSet
+_rules_source = (None, None)    # (rules snapshot, broker config snapshot)
+_rules_conf = {}
+_rule_memo = {}                 # (broker, path) -> Decision
+
+def _compiled_rules():
+    global _rules, _rules_source, _rules_conf, _rule_memo
+    try:
+        conf = config_store.leverage_rules()
+    except (OSError, ValueError) as e:
+        logging.error(f"[Get leverage] Cannot read {config_store.LEVERAGE_RULES_PATH.name}: {e}")
+        conf = {}
+    brokers = config_store.broker_config()
+    if _rules_source[0] is conf and _rules_source[1] is brokers:
+        return _rules, _rules_conf
+    with _lock:
+        if not (_rules_source[0] is conf and _rules_source[1] is brokers):
+            compiled = {name: RuleSet(name, spec) for name, spec in conf.get("rule_sets", {}).items()}
+            _rules, _rules_conf, _rule_memo = compiled, conf, {}
+            _rules_source = (conf, brokers)
+            logging.info(f"[Get leverage] Compiled leverage rule sets: {', '.join(compiled) or 'none'}")
+        return _rules, _rules_conf
+
+def rule_set_for(broker: str) -> RuleSet:
+    rules, conf = _compiled_rules()
+    entry = config_store.broker_config().get(broker) or {}
+    name = entry.get("leverage_rules")
+    if not name:
+        lowered = broker.lower()
+        name = next((set_name for text, set_name in conf.get("select", ()) if text in lowered),
+                    conf.get("default", "standard"))
+    rs = rules.get(name)
+    if rs is None:
+        logging.error(f"[Get leverage] Unknown leverage rule set '{name}' for {broker}")
+    return rs
+
+def match_rules(broker: str, path: str) -> Decision:
+    """Rule-based leverage for a symbol path on ``broker``, memoized per (broker, path)."""
+    rules, conf = _compiled_rules()
+    key = (broker, path)
+    hit = _rule_memo.get(key)
+    if hit is not None:
+        return hit
+    rs = rule_set_for(broker)
+    fallback = float(conf.get("fallback_leverage", 10.0))
+    if rs is None:
+        decision = Decision(fallback, "default", "no rule set")
+    elif rs.flat is not None:
+        decision = Decision(rs.flat, "flat", f"rule set {rs.name}")
+    else:
+        m = rs.match(segments(path))
+        if m:
+            i, kw, seg = m
+            decision = Decision(rs.rules[i][1], "rule", f"{rs.name} #{i + 1} '{kw}' on segment '{seg}'")
+        else:
+            decision = Decision(fallback, "default", f"no {rs.name} rule matches '{path}'")
+    _rule_memo[key] = decision
+    return decision
+
+def decide(broker: str, name: str, path: str) -> Decision:
+    """Leverage for broker symbol ``name`` with MT5 path ``path``: the map entry, a
+    category default, the stock path default, then the broker's rules."""
+    d = _from_map(name, path)
+    if d:
+        return d
+    if "stock" in path.lower():
+        return Decision(5.0, "stock path", path)
+    return match_rules(broker, path)
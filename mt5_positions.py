@@ -0,0 +1,225 @@
+import logging
+import threading
+import time
+from typing import NamedTuple
+from mt5_gateway import mt5
+
+# — Position book —
+# The executor's own view of open positions. It is loaded with one positions_get()
+# at connect(), updated in place from our own order_send results, and reconciled with
+# the terminal in the background: positions_total() every RECONCILE_INTERVAL, and a
+# full positions_get() diff only when the count moved, after our own writes, or every
+# FULL_RECONCILE seconds (SL/TP hits and manual trades can leave the count unchanged).
+# Per-symbol volume and open nominal are kept as running sums, so sizing and the
+# close/modify paths read memory instead of the terminal.
+
+RECONCILE_INTERVAL = 0.25
+FULL_RECONCILE = 5.0
+
+class Position(NamedTuple):
+    """The TradePosition fields the executor uses; terminal positions and our own
+    fills are both stored in this shape."""
+    ticket: int
+    symbol: str
+    type: int
+    volume: float
+    price_open: float
+    sl: float
+    tp: float
+    magic: int
+    comment: str
+
+    @classmethod
+    def from_terminal(cls, p):
+        return cls(p.ticket, p.symbol, p.type, p.volume, p.price_open, p.sl, p.tp, p.magic, p.comment)
+
+class PositionBook:
+    def __init__(self):
+        self._by_ticket = {}        # ticket -> Position
+        self._by_symbol = {}        # symbol -> {ticket: Position}
+        self._exposure = {}         # symbol -> [volume, sum(volume * price_open)]
+        self._lock = threading.RLock()
+        self._dirty = False         # our writes since the last full diff
+        self._last_full = 0.0
+        self._netting = False
+        self._thread = None
+        self._stop = threading.Event()
+        self.ready = False
+        self.version = 0            # bumped on every change, for caches built over the book
+        self.stats = {"full_diffs": 0, "skipped": 0, "drift": 0, "raced": 0}
+
+    # — Internal bookkeeping (callers hold the lock) —
+    def _add(self, p: Position):
+        self._drop(p.ticket)
+        self.version += 1
+        self._by_ticket[p.ticket] = p
+        self._by_symbol.setdefault(p.symbol, {})[p.ticket] = p
+        exp = self._exposure.setdefault(p.symbol, [0.0, 0.0])
+        exp[0] += p.volume
+        exp[1] += p.volume * p.price_open
+
+    def _drop(self, ticket: int):
+        p = self._by_ticket.pop(ticket, None)
+        if p is None:
+            return None
+        self.version += 1
+        tickets = self._by_symbol[p.symbol]
+        del tickets[ticket]
+        if not tickets:
+            del self._by_symbol[p.symbol]
+            del self._exposure[p.symbol]
+        else:
+            exp = self._exposure[p.symbol]
+            exp[0] -= p.volume
+            exp[1] -= p.volume * p.price_open
+        return p
+
+    def _load(self, positions):
+        self._by_ticket.clear()
+        self._by_symbol.clear()
+        self._exposure.clear()
+        for p in positions:
+            self._add(Position.from_terminal(p))
+
+    # — Reads —
+    @property
+    def netting(self) -> bool:
+        return self._netting
+
+    def __len__(self):
+        return len(self._by_ticket)
+
+    def positions(self, symbol: str = None) -> tuple:
+        """Open positions, all or for one symbol. Goes to the terminal until the book
+        has been loaded (e.g. in a process that never called connect())."""
+        if not self.ready:
+            got = mt5.positions_get(symbol=symbol) if symbol else mt5.positions_get()
+            return tuple(got or ())
+        with self._lock:
+            if symbol is None:
+                return tuple(self._by_ticket.values())
+            return tuple(self._by_symbol.get(symbol, {}).values())
+
+    def get(self, ticket: int):
+        if not self.ready:
+            got = mt5.positions_get(ticket=ticket)
+            return got[0] if got else None
+        return self._by_ticket.get(ticket)
+
+    def exposure(self, symbol: str) -> tuple:
+        """(total volume, sum of volume * price_open) of the symbol's open positions;
+        multiply the second by the contract size for the aggregate nominal."""
+        if not self.ready:
+            pl = self.positions(symbol)
+            return sum(p.volume for p in pl), sum(p.volume * p.price_open for p in pl)
+        with self._lock:
+            exp = self._exposure.get(symbol)
+            # Running sums pick up float noise as positions come and go
+            return (round(exp[0], 8), round(exp[1], 8)) if exp else (0.0, 0.0)
+
+    # — Updates from our own trades —
+    def opened(self, req: dict, res):
+        """A TRADE_ACTION_DEAL opening order came back 10009."""
+        if not self.ready:
+            return
+        with self._lock:
+            self._dirty = True
+            if self._netting:
+                # Netting merges into the symbol's single position; take the terminal's word
+                self._refresh_symbol(req["symbol"])
+                return
+            self._add(Position(res.order, req["symbol"], req["type"], res.volume or req["volume"],
+                               res.price or req["price"], req.get("sl", 0.0), req.get("tp", 0.0),
+                               req.get("magic", 0), req.get("comment", "")))
+
+    def closed(self, ticket: int, volume: float = None):
+        """A close of ``volume`` (all of it when None) on ``ticket`` came back 10009."""
+        if not self.ready:
+            return
+        with self._lock:
+            self._dirty = True
+            p = self._drop(ticket)
+            if p is not None and volume is not None and volume < p.volume - 1e-9:
+                self._add(p._replace(volume=round(p.volume - volume, 8)))
+
+    def modified(self, ticket: int, sl: float = None, tp: float = None):
+        if not self.ready:
+            return
+        with self._lock:
+            self._dirty = True
+            p = self._by_ticket.get(ticket)
+            if p is not None:
+                self._add(p._replace(sl=p.sl if sl is None else sl, tp=p.tp if tp is None else tp))
+
+    # — Reconciliation with the terminal —
+    def _refresh_symbol(self, symbol: str):
+        for ticket in list(self._by_symbol.get(symbol, {})):
+            self._drop(ticket)
+        for p in mt5.positions_get(symbol=symbol) or ():
+            self._add(Position.from_terminal(p))
+
+    def sync(self):
+        """Full reload; called from connect() (and after a broker switch)."""
+        acct = mt5.account_info()
+        netting = bool(acct) and acct.margin_mode == mt5.ACCOUNT_MARGIN_MODE_RETAIL_NETTING
+        positions = mt5.positions_get()
+        with self._lock:
+            self._netting = netting
+            self._load(positions or ())
+            self._dirty = False
+            self._last_full = time.monotonic()
+            self.ready = positions is not None
+        logging.info(f"[POSITIONS] Book loaded: {len(self)} open positions")
+
+    def reconcile(self):
+        total = mt5.positions_total()
+        now = time.monotonic()
+        if total is None:
+            return
+        with self._lock:
+            due = self._dirty or total != len(self._by_ticket) or now - self._last_full >= FULL_RECONCILE
+            if not due:
+                self.stats["skipped"] += 1
+                return
+            seen = self.version
+        positions = mt5.positions_get()
+        if positions is None:
+            return
+        theirs = {p.ticket: Position.from_terminal(p) for p in positions}
+        with self._lock:
+            if self.version != seen:
+                # Our own trade landed while the snapshot was taken: it may be missing
+                # from (or already gone in) the snapshot. Stay dirty and diff again next tick.
+                self.stats["raced"] += 1
+                self._dirty = True
+                return
+            ours = self._by_ticket
+            added = [t for t in theirs if t not in ours]
+            gone = [t for t in ours if t not in theirs]
+            changed = [t for t in theirs if t in ours and theirs[t] != ours[t]]
+            for t in gone:
+                self._drop(t)
+            for t in added + changed:
+                self._add(theirs[t])
+            self._dirty = False
+            self._last_full = time.monotonic()
+            self.stats["full_diffs"] += 1
+            if added or gone or changed:
+                self.stats["drift"] += 1
+                logging.detailed(f"[POSITIONS] Reconciled: +{len(added)} -{len(gone)} ~{len(changed)}")
+
+    def start(self, interval: float = RECONCILE_INTERVAL):
+        """Load the book and keep it reconciled from a daemon thread (started once)."""
+        self.sync()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True, name="positions")
+            self._thread.start()
+
+    def _run(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                logging.warning(f"[POSITIONS] Reconcile failed: {e}")
+
+book = PositionBook()
@@ -0,0 +1,161 @@
+import logging
+import time
+from typing import NamedTuple
+import numpy as np
+
+# — Portfolio what-if / stress engine —
+# Open positions are folded per symbol into arrays (net and gross units, current price,
+# leverage or tier schedule), and a grid of price shocks is evaluated in one vectorized
+# pass. Equity moves with the net exposure; margin moves with the gross nominal through
+# each symbol's leverage or tier schedule. Prices, P/L and nominals are in each symbol's
+# quote currency and are converted to account currency with a per-symbol factor (tick
+# value / tick size / contract size). Modelled margin is applied as a delta on the
+# terminal's reported margin, so the base scenario always matches the account.
+
+DEFAULT_MOVE = 0.05         # relative move for symbols without a configured one
+
+class StressResult(NamedTuple):
+    names: list             # scenario names
+    equity: np.ndarray
+    margin: np.ndarray
+    margin_level: np.ndarray    # percent; inf without margin
+    call_distance: np.ndarray   # equity above the margin-call level, in account currency
+
+    def worst(self) -> int:
+        """Index of the scenario with the lowest margin level."""
+        return int(np.argmin(self.margin_level))
+
+    def rows(self) -> list:
+        return [{"scenario": n, "equity": float(e), "margin": float(m), "margin_level": float(l),
+                 "call_distance": float(d)}
+                for n, e, m, l, d in zip(self.names, self.equity, self.margin, self.margin_level, self.call_distance)]
+
+class RiskSnapshot:
+    """Per-symbol arrays over the open positions plus the account figures they are
+    stressed against. ``with_order`` returns a copy with a candidate order added."""
+
+    def __init__(self, symbols, net, gross, price, leverage, tiers, equity, margin, so_call, fx=None):
+        self.symbols = list(symbols)
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        self.net = np.asarray(net, dtype=float)          # signed units (volume * contract size)
+        self.gross = np.asarray(gross, dtype=float)      # unsigned units, what margin is charged on
+        self.price = np.asarray(price, dtype=float)
+        self.leverage = np.asarray(leverage, dtype=float)
+        self.tiers = dict(tiers)                         # column -> (nominal knots, margin knots)
+        # account currency per unit of quote currency
+        self.fx = np.ones(len(self.symbols)) if fx is None else np.asarray(fx, dtype=float)
+        self.equity = float(equity)
+        self.margin = float(margin)
+        self.so_call = float(so_call)
+        self.built_at = time.monotonic()
+        self._base_model = None
+
+    def _model_margin(self, prices: np.ndarray) -> np.ndarray:
+        """Modelled margin per scenario for ``prices`` of shape (scenarios, symbols)."""
+        nominal = self.gross * prices
+        with np.errstate(divide="ignore", invalid="ignore"):
+            per_symbol = np.where(self.leverage > 0, nominal / self.leverage, 0.0)
+        for col, (xs, ys) in self.tiers.items():
+            per_symbol[:, col] = np.interp(nominal[:, col], xs, ys)
+        return (per_symbol * self.fx).sum(axis=1)
+
+    def base_model(self) -> float:
+        if self._base_model is None:
+            self._base_model = float(self._model_margin(self.price[None, :])[0])
+        return self._base_model
+
+    def with_order(self, symbol: str, side: int, units: float, price: float,
+                   leverage: float, tiers=None, fx: float = 1.0) -> "RiskSnapshot":
+        """``side`` +1 buy / -1 sell; ``units`` is volume * contract size; ``fx``
+        converts the symbol's quote currency to account currency."""
+        base = self.base_model()
+        symbols, net, gross = list(self.symbols), self.net.copy(), self.gross.copy()
+        prices, levs, tier_map, fxs = self.price.copy(), self.leverage.copy(), dict(self.tiers), self.fx.copy()
+        col = self.index.get(symbol)
+        if col is None:
+            col = len(symbols)
+            symbols.append(symbol)
+            net, gross = np.append(net, 0.0), np.append(gross, 0.0)
+            prices, levs = np.append(prices, price), np.append(levs, leverage)
+            fxs = np.append(fxs, fx)
+            if tiers is not None:
+                tier_map[col] = tiers
+        net[col] += side * units
+        gross[col] += units
+        snap = RiskSnapshot(symbols, net, gross, prices, levs, tier_map, self.equity, self.margin, self.so_call, fxs)
+        snap._base_model = base     # the terminal's margin does not include the candidate yet
+        return snap
+
+    def scenarios(self, moves: dict = None):
+        """(names, shocks) with shocks of shape (scenarios, symbols): the base case,
+        each symbol up and down by its move, and every symbol against its net
+        position at once. ``moves`` maps symbol (or "*") -> relative move."""
+        moves = moves or {}
+        k = len(self.symbols)
+        rows, names = [np.zeros(k)], ["base"]
+        for i, sym in enumerate(self.symbols):
+            m = float(moves.get(sym, moves.get("*", DEFAULT_MOVE)))
+            for sign in (1, -1):
+                row = np.zeros(k)
+                row[i] = sign * m
+                rows.append(row)
+                names.append(f"{sym} {sign * m:+.1%}")
+        if k > 1:
+            adverse = np.array([-np.sign(self.net[i]) * float(moves.get(s, moves.get("*", DEFAULT_MOVE)))
+                                for i, s in enumerate(self.symbols)])
+            rows.append(adverse)
+            names.append("all adverse")
+        return names, np.vstack(rows)
+
+    def evaluate(self, shocks: np.ndarray, names: list = None) -> StressResult:
+        shocks = np.atleast_2d(np.asarray(shocks, dtype=float))
+        prices = self.price * (1.0 + shocks)
+        pnl = (self.net * self.price * shocks * self.fx).sum(axis=1)
+        margin = self.margin + self._model_margin(prices) - self.base_model()
+        equity = self.equity + pnl
+        with np.errstate(divide="ignore", invalid="ignore"):
+            level = np.where(margin > 0, equity / margin * 100.0, np.inf)
+        call_distance = equity - margin * self.so_call / 100.0
+        names = names or [f"#{i}" for i in range(len(shocks))]
+        return StressResult(names, equity, np.maximum(margin, 0.0), level, call_distance)
+
+    def stress(self, moves: dict = None) -> StressResult:
+        names, shocks = self.scenarios(moves)
+        return self.evaluate(shocks, names)
+
+def tier_knots(schedule):
+    """np.interp knots for a TierSchedule, extended far past its last bound."""
+    xs = list(schedule.lows)
+    ys = list(schedule.cum)
+    far = xs[-1] + 1e12
+    return np.array(xs + [far]), np.array(ys + [ys[-1] + (far - xs[-1]) / schedule.levs[-1]])
+
+def build(positions, account, price_of, contract_of, leverage_of, schedule_of, value_of=None) -> RiskSnapshot:
+    """Fold ``positions`` per symbol. The callables supply each symbol's current
+    price, contract size, flat leverage, tier schedule (or None) and the account-currency
+    value of a 1.0 price move on one lot (None: quoted in the account currency)."""
+    symbols, net, gross, price, lev, tiers, fx = [], [], [], [], [], {}, []
+    col_of = {}
+    for p in positions:
+        col = col_of.get(p.symbol)
+        if col is None:
+            col = col_of[p.symbol] = len(symbols)
+            symbols.append(p.symbol)
+            net.append(0.0)
+            gross.append(0.0)
+            contract = contract_of(p.symbol) or 1.0
+            fx.append((value_of(p.symbol) or contract) / contract if value_of else 1.0)
+            price.append(price_of(p.symbol) or p.price_open)
+            schedule = schedule_of(p.symbol)
+            if schedule:
+                tiers[col] = tier_knots(schedule)
+                lev.append(0.0)
+            else:
+                lev.append(leverage_of(p.symbol) or 0.0)
+        units = p.volume * contract_of(p.symbol)
+        net[col] += units if p.type == 0 else -units      # ORDER_TYPE_BUY == 0
+        gross[col] += units
+    so_call = getattr(account, "margin_so_call", 0.0) or 0.0
+    snap = RiskSnapshot(symbols, net, gross, price, lev, tiers, account.equity, account.margin, so_call, fx)
+    logging.detailed(f"[RISK] Snapshot over {len(symbols)} symbols, equity {snap.equity:.2f}, margin {snap.margin:.2f}")
+    return snap
@@ -0,0 +1,405 @@
+import json
+import logging
+import pathlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from mt5_gateway import mt5
+from utils.symbols_alias import GROUPED_ALIASES
+from utils.trigram import TrigramIndex
+
+# Every alias (and the canonical name itself) -> canonical MT5 symbol
+ALIAS_TO_SYMBOL = {alias.upper(): symbol for symbol, aliases in GROUPED_ALIASES.items() for alias in aliases + [symbol]}
+
+_NON_ALNUM = re.compile(r"[^A-Z0-9]")
+CACHE_DIR = pathlib.Path(__file__).parent / "cache"
+
+def cache_file(kind: str, broker: str) -> pathlib.Path:
+    """cache/<kind>-<broker>.json, with the broker name made safe for a file name."""
+    name = re.sub(r"[^A-Za-z0-9_-]+", "_", broker.strip()) or "default"
+    return CACHE_DIR / f"{kind}-{name}.json"
+
+def save_json(path: pathlib.Path, data, tag: str):
+    """Write ``data`` through a temp file, so a crash never leaves half a cache behind."""
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        tmp.replace(path)
+    except OSError as e:
+        logging.warning(f"[{tag}] Could not save {path.name}: {e}")
+
+def normalize(text: str) -> str:
+    """Upper-case and strip separators: 'xau/usd' -> 'XAUUSD', 'US30.cash' -> 'US30CASH'."""
+    return _NON_ALNUM.sub("", text.upper())
+
+# — Per-broker symbol index —
+class SymbolIndex:
+    """Everything resolve_symbol needs from mt5.symbols_get(), built once per broker.
+
+    * ``names``   exact upper-case name -> broker name
+    * ``norm``    normalized name -> broker name
+    * ``alias``   ALIAS_TO_SYMBOL restricted to canonicals this broker lists
+    * ``subs``    every substring of every name -> best candidate
+    * ``tokens``  every description word -> best candidate
+    * ``fuzzy``   trigram index over names, descriptions and aliases, for text that
+                  none of the exact probes recognise
+
+    "Best" keeps the old linear scan's tie-break: shortest description, then the
+    first symbol in symbols_get() order.
+    """
+
+    def __init__(self, broker: str, symbols):
+        self.broker = broker
+        self.built_at = time.time()
+        self.names = {}
+        self.norm = {}
+        self.subs = {}
+        self.tokens = {}
+        self.visible = set()
+        self.info = {}          # broker name -> SymbolInfo as of the build
+        self.fillings = {}      # broker name -> filling modes symbol_info allows, in try order
+        for order, s in enumerate(symbols):
+            name = s.name
+            upper = name.upper()
+            desc = (getattr(s, "description", "") or "").upper()
+            rank = (len(getattr(s, "description", "") or ""), order)
+            self.info[name] = s
+            self.fillings[name] = allowed_fillings(s)
+            self.names.setdefault(upper, name)
+            self.norm.setdefault(normalize(name), name)
+            if s.visible:
+                self.visible.add(name)
+            for i in range(len(upper)):
+                for j in range(i + 1, len(upper) + 1):
+                    self._offer(self.subs, upper[i:j], rank, name)
+            for word in desc.split():
+                self._offer(self.tokens, word, rank, name)
+        self.alias = {alias: self.names[canonical.upper()]
+                      for alias, canonical in ALIAS_TO_SYMBOL.items() if canonical.upper() in self.names}
+        self.fuzzy = TrigramIndex()
+        for name, s in self.info.items():
+            self.fuzzy.add(name, name)
+            if getattr(s, "description", ""):
+                self.fuzzy.add(name, s.description)
+        for alias, name in self.alias.items():
+            self.fuzzy.add(name, alias)
+
+    @staticmethod
+    def _offer(table: dict, key: str, rank: tuple, name: str):
+        cur = table.get(key)
+        if cur is None or rank < cur[0]:
+            table[key] = (rank, name)
+
+    def lookup(self, sym: str):
+        """Broker symbol for the text a signal used, or None. Pure dictionary probes."""
+        raw = sym.strip().upper()
+        norm = raw.replace("/", "")
+        # 1) Exact name, then the alias table, then separator-insensitive name
+        hit = (self.names.get(norm) or self.names.get(raw)
+               or self.alias.get(norm) or self.alias.get(raw)
+               or self.norm.get(normalize(raw)))
+        if hit:
+            return hit
+        # 2) Name contains the text, or a description word equals it
+        found = [c for c in (self.subs.get(raw), self.subs.get(norm),
+                             self.tokens.get(raw), self.tokens.get(norm)) if c]
+        if found:
+            return min(found)[1]
+        return None
+
+    def fuzzy_lookup(self, sym: str, threshold: float, budget_ms: float):
+        """(best name or None, ranked [(score, name, matched text)]). The best match
+        is returned only when its score reaches ``threshold``."""
+        ranked = self.fuzzy.search(sym, limit=4, budget_ms=budget_ms)
+        if ranked and ranked[0][0] >= threshold:
+            return ranked[0][1], ranked
+        return None, ranked
+
+    def ensure_visible(self, name: str):
+        if name not in self.visible:
+            mt5.symbol_select(name, True)
+            self.visible.add(name)
+
+def price_value(info) -> float:
+    """Account-currency value of a 1.0 price move on one lot. Equals the contract
+    size for symbols quoted in the account currency."""
+    if info is None:
+        return 1.0
+    if getattr(info, "trade_tick_size", 0) > 0 and getattr(info, "trade_tick_value", 0) > 0:
+        return info.trade_tick_value / info.trade_tick_size
+    return info.trade_contract_size or 1.0
+
+def allowed_fillings(info) -> tuple:
+    """ORDER_FILLING_* modes worth trying for a symbol, from its filling_mode flags.
+    RETURN has no flag and is always kept as the last resort."""
+    mask = getattr(info, "filling_mode", 0) or 0
+    modes = []
+    if mask & mt5.SYMBOL_FILLING_IOC:
+        modes.append(mt5.ORDER_FILLING_IOC)
+    if mask & mt5.SYMBOL_FILLING_FOK:
+        modes.append(mt5.ORDER_FILLING_FOK)
+    modes.append(mt5.ORDER_FILLING_RETURN)
+    return tuple(modes)
+
+_index: SymbolIndex = None
+
+def build_index(broker: str) -> SymbolIndex:
+    """(Re)build the index for the logged-in broker. Called from connect()."""
+    global _index
+    t0 = time.perf_counter()
+    symbols = mt5.symbols_get() or ()
+    idx = SymbolIndex(broker, symbols)
+    _index = idx
+    logging.info(f"[SYMBOLS] Indexed {len(idx.info)} symbols for {broker} in {(time.perf_counter() - t0) * 1000:.0f}ms")
+    return idx
+
+def current_index() -> SymbolIndex:
+    return _index
+
+def info(name: str):
+    """symbol_info for ``name``, from the index when it has it."""
+    return (_index and _index.info.get(name)) or mt5.symbol_info(name)
+
+# — Warm pool: symbols selected in Market Watch with a live tick before any signal —
+WARM_TIMEOUT = 3.0          # connect() waits this long, in total, for first ticks
+WARM_REFRESH = 30.0         # seconds between background checks of the pool
+RECENT_DAYS = 14            # symbols traded this recently are warmed too
+COLD_WAIT = 0.5             # hot path: longest wait for the first tick of a cold symbol
+
+class WarmPool:
+    def __init__(self):
+        self.warm = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _has_tick(name: str) -> bool:
+        tick = mt5.symbol_info_tick(name)
+        return bool(tick) and tick.time > 0
+
+    def targets(self, idx: SymbolIndex, extra=()) -> set:
+        """Every GROUPED_ALIASES canonical the broker lists, plus ``extra`` names
+        (recent deals, open positions, memoized resolutions) it knows."""
+        names = {idx.lookup(canonical) for canonical in GROUPED_ALIASES}
+        names.update(n for n in extra if n in idx.info)
+        names.discard(None)
+        return names
+
+    def fill(self, names):
+        """Select ``names`` and wait (up to WARM_TIMEOUT overall) for their first ticks."""
+        t0 = time.perf_counter()
+        pending = []
+        for name in names:
+            mt5.symbol_select(name, True)
+            pending.append(name)
+        if _index is not None:
+            _index.visible.update(pending)
+        deadline = time.monotonic() + WARM_TIMEOUT
+        while True:
+            pending = [n for n in pending if not self._has_tick(n)]
+            if not pending or time.monotonic() >= deadline:
+                break
+            time.sleep(0.05)
+        with self._lock:
+            self.warm = set(names) - set(pending)
+        logging.info(f"[SYMBOLS] Warm pool: {len(self.warm)} symbols live in {(time.perf_counter() - t0) * 1000:.0f}ms"
+                     + (f", no tick yet for {len(pending)}: {sorted(pending)[:10]}" if pending else ""))
+
+    def ensure(self, name: str) -> bool:
+        """Hot path: nothing to do for a warm symbol; a cold one is selected and
+        awaited until its first tick (at most COLD_WAIT) and joins the pool."""
+        if name in self.warm:
+            return True
+        mt5.symbol_select(name, True)
+        if _index is not None:
+            _index.visible.add(name)
+        deadline = time.monotonic() + COLD_WAIT
+        while not self._has_tick(name):
+            if time.monotonic() >= deadline:
+                logging.warning(f"[SYMBOLS] {name} has no tick after {COLD_WAIT * 1000:.0f}ms")
+                return False
+            time.sleep(0.005)
+        with self._lock:
+            self.warm.add(name)
+        return True
+
+    def refresh(self):
+        """Re-select pool members that lost their tick (e.g. removed from Market Watch)."""
+        for name in list(self.warm):
+            if not self._has_tick(name):
+                mt5.symbol_select(name, True)
+                logging.detailed(f"[SYMBOLS] Re-selected {name}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="warm-pool")
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(WARM_REFRESH):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.warning(f"[SYMBOLS] Warm pool refresh failed: {e}")
+
+warm_pool = WarmPool()
+
+def recently_traded(days: int = RECENT_DAYS) -> set:
+    now = datetime.now()
+    deals = mt5.history_deals_get(now - timedelta(days=days), now + timedelta(days=1)) or ()
+    return {d.symbol for d in deals if d.symbol}
+
+# — Resolution memo: (broker, signal text) -> broker symbol, persisted per broker —
+MEMO_SIZE    = 2048
+POSITIVE_TTL = 7 * 24 * 3600    # a resolved name is trusted for a week
+NEGATIVE_TTL = 10 * 60          # a miss is retried after ten minutes
+MISS = object()
+
+class ResolutionMemo:
+    """LRU of raw signal text -> broker symbol (or None for a known miss), with TTLs.
+
+    Persisted to cache/symbols-<broker>.json so that after a restart a known symbol
+    resolves without any terminal call.
+    """
+
+    def __init__(self, broker: str, size: int = MEMO_SIZE):
+        self.broker = broker
+        self.size = size
+        self.path = cache_file("symbols", broker)
+        self._items = OrderedDict()     # raw -> (name or None, expires_at)
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+        self._load()
+
+    def _load(self):
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.warning(f"[SYMBOLS] Ignoring unreadable {self.path.name}: {e}")
+            return
+        now = time.time()
+        for raw, (name, expires) in data.items():
+            if expires > now:
+                self._items[raw] = (name, expires)
+
+    def _save(self):
+        save_json(self.path, dict(self._items), "SYMBOLS")
+
+    def get(self, raw: str):
+        """Memoized result for ``raw``: a name, None for a known miss, or MISS."""
+        with self._lock:
+            hit = self._items.get(raw)
+            if hit is None or hit[1] <= time.time():
+                self.misses += 1
+                return MISS
+            self._items.move_to_end(raw)
+            self.hits += 1
+            return hit[0]
+
+    def put(self, raw: str, name):
+        ttl = POSITIVE_TTL if name is not None else NEGATIVE_TTL
+        with self._lock:
+            self._items[raw] = (name, time.time() + ttl)
+            self._items.move_to_end(raw)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._save()
+
+    def names(self) -> set:
+        """Broker symbols this memo currently resolves to."""
+        with self._lock:
+            return {hit[0] for hit in self._items.values() if hit[0]}
+
+_memos: dict = {}
+_memos_lock = threading.Lock()
+
+def memo(broker: str) -> ResolutionMemo:
+    m = _memos.get(broker)
+    if m is None:
+        with _memos_lock:
+            m = _memos.get(broker)
+            if m is None:
+                m = _memos[broker] = ResolutionMemo(broker)
+    return m
+
+# — Fuzzy resolutions and misses, kept for growing GROUPED_ALIASES —
+FUZZY_LOG = CACHE_DIR / "fuzzy-matches.jsonl"
+
+def log_fuzzy(broker: str, text: str, chosen, ranked):
+    line = {"t": round(time.time()), "broker": broker, "text": text, "chosen": chosen,
+            "candidates": [[round(score, 3), name, matched] for score, name, matched in ranked]}
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        with open(FUZZY_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(line) + "\n")
+    except OSError as e:
+        logging.warning(f"[SYMBOLS] Could not write {FUZZY_LOG.name}: {e}")
+
+# — Filling modes that worked, per (broker, symbol), persisted —
+class FillingCache:
+    """symbol -> the ORDER_FILLING_* mode the broker last accepted, so the next order
+    goes out with it first. Persisted to cache/filling-<broker>.json."""
+
+    def __init__(self, broker: str):
+        self.broker = broker
+        self.path = cache_file("filling", broker)
+        self._modes = {}
+        self._lock = threading.Lock()
+        try:
+            self._modes = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"[SYMBOLS] Ignoring unreadable {self.path.name}: {e}")
+
+    def _save(self):
+        save_json(self.path, self._modes, "SYMBOLS")
+
+    def order(self, symbol: str) -> tuple:
+        """Modes to try for ``symbol``: the learned one, then what symbol_info allows."""
+        if _index is not None and symbol in _index.fillings:
+            allowed = _index.fillings[symbol]
+        else:
+            info = mt5.symbol_info(symbol)
+            allowed = allowed_fillings(info) if info else (mt5.ORDER_FILLING_IOC, mt5.ORDER_FILLING_FOK, mt5.ORDER_FILLING_RETURN)
+        learned = self._modes.get(symbol)
+        if learned is None:
+            return allowed
+        return (learned,) + tuple(m for m in allowed if m != learned)
+
+    def learn(self, symbol: str, mode: int):
+        if self._modes.get(symbol) == mode:
+            return
+        with self._lock:
+            self._modes[symbol] = mode
+            self._save()
+
+    def forget(self, symbol: str, mode: int):
+        """The learned mode came back 10030 (unsupported); stop leading with it."""
+        if self._modes.get(symbol) != mode:
+            return
+        with self._lock:
+            self._modes.pop(symbol, None)
+            self._save()
+
+_fillings: dict = {}
+
+def fillings(broker: str) -> FillingCache:
+    f = _fillings.get(broker)
+    if f is None:
+        with _memos_lock:
+            f = _fillings.get(broker)
+            if f is None:
+                f = _fillings[broker] = FillingCache(broker)
+    return f
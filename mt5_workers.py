@@ -0,0 +1,393 @@
+import functools
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import types
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from utils import config_store
+
+# — Hot-standby broker workers —
+# The MetaTrader5 library drives one terminal per process, so switching brokers in
+# process means shutdown/initialize/login and seconds without a session. With
+# "broker_workers" on in settings.json, every broker in mt5_credentials.json that has
+# its own terminal install ("terminal_path" in its entry, not shared with another
+# broker; "standby": false opts out) gets its own worker process, pinned to that
+# broker, logged in and warm through the usual connect(). Brokers without one are
+# skipped: workers sharing a terminal would all trade the last account logged in.
+# Executor calls are sent over a pipe to the
+# worker of the active broker; switching brokers only changes which worker that is.
+#
+# Module-level send_order / close_pos / ... route to the active worker when the pool is
+# running and call mt5_executor directly otherwise.
+#
+# Fan-out: with "fanout_accounts" in settings.json, the trading calls (FANOUT) go to
+# every listed account's worker at once instead. Each worker sizes with its own
+# settings (the broker's "settings_profile" overlays settings.json) and its own
+# leverage map. Results come back as a FanoutReport with per-account retcode and
+# latency. An account that has not answered within fanout_timeout_ms is reported as
+# still running, so one slow terminal does not hold up the execution lane. The next
+# call for the same symbol on that account is held back until the earlier one has
+# finished, so a CLOSE never overtakes (or races) the OPEN it follows.
+
+STARTUP_TIMEOUT = 120.0     # seconds to wait for workers to log in and warm up
+FANOUT_TIMEOUT = 10.0       # seconds a fan-out waits for its slowest account
+ROUTED = ("send_order", "close_pos", "flatten", "modify_position", "modify_by_symbol",
+          "resolve_symbol", "refresh_commissions", "account_summary")
+FANOUT = ("send_order", "close_pos", "flatten", "modify_by_symbol")
+
+# — Worker process side —
+def _portable(obj):
+    """Picklable copy of an executor result: MT5 structs and fake() results become
+    SimpleNamespaces, BatchReports (plain dicts inside) travel as they are."""
+    if obj is None or isinstance(obj, (bool, int, float, str, bytes)):
+        return obj
+    if isinstance(obj, (list, tuple)) and not hasattr(obj, "_asdict"):
+        return type(obj)(_portable(v) for v in obj)
+    if isinstance(obj, dict):
+        return {k: _portable(v) for k, v in obj.items()}
+    if type(obj).__name__ == "BatchReport":
+        return obj
+    if hasattr(obj, "_asdict"):
+        return types.SimpleNamespace(**{k: _portable(v) for k, v in obj._asdict().items()})
+    if hasattr(obj, "__dict__"):
+        return types.SimpleNamespace(**{k: _portable(v) for k, v in vars(obj).items()})
+    return obj
+
+def _worker_main(broker: str, conn, threads: int):
+    from utils.logger import setup_logger
+    setup_logger()
+    config_store.pin_broker(broker)
+    import mt5_executor
+    ok = mt5_executor.connect()
+    logging.info(f"[WORKER] {broker}: {'ready' if ok else 'connect failed'}")
+    conn.send(("ready", ok))
+    send_lock = threading.Lock()
+
+    def serve(call_id, fn, args, kwargs):
+        try:
+            if fn not in ROUTED:
+                raise AttributeError(f"{fn} is not served by broker workers")
+            reply = (call_id, True, _portable(getattr(mt5_executor, fn)(*args, **kwargs)), kwargs.get("trace"))
+        except Exception as e:
+            reply = (call_id, False, e, kwargs.get("trace"))
+        with send_lock:
+            try:
+                conn.send(reply)
+            except Exception as e:  # A result or error that does not pickle
+                conn.send((call_id, False, RuntimeError(f"{fn}: {e}"), None))
+
+    # Threads, so one symbol's order does not wait behind another's (the gateway
+    # still serializes the terminal calls)
+    pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"worker-{broker}")
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        pool.submit(serve, *msg)
+    pool.shutdown(wait=True)
+
+# — Parent side —
+class BrokerWorker:
+    def __init__(self, broker: str, mp, threads: int, target=_worker_main):
+        self.broker = broker
+        self._conn, child = mp.Pipe()
+        self.process = mp.Process(target=target, args=(broker, child, threads), daemon=True,
+                                  name=f"mt5-{broker}")
+        self._pending = {}      # call id -> (Future, caller's trace)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.ready = threading.Event()
+        self.ok = False
+        self.alive = True
+        self._stopping = False
+
+    def start(self):
+        self.process.start()
+        threading.Thread(target=self._read, daemon=True, name=f"worker-{self.broker}").start()
+
+    def _read(self):
+        try:
+            while True:
+                msg = self._conn.recv()
+                if msg[0] == "ready":
+                    self.ok = msg[1]
+                    self.ready.set()
+                    continue
+                call_id, ok, payload, trace = msg
+                with self._lock:
+                    fut, caller_trace = self._pending.pop(call_id)
+                if trace is not None and caller_trace is not None:
+                    # The worker's marks belong to the caller's trace
+                    for slot in type(trace).__slots__:
+                        setattr(caller_trace, slot, getattr(trace, slot))
+                if ok:
+                    fut.set_result(payload)
+                else:
+                    fut.set_exception(payload)
+        except (EOFError, OSError):
+            pass
+        self.alive = False
+        self.ready.set()
+        (logging.info if self._stopping else logging.error)(f"[WORKER] {self.broker} exited")
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for fut, _ in pending.values():
+            fut.set_exception(ConnectionError(f"broker worker {self.broker} exited"))
+
+    def submit(self, fn: str, *args, _adopt_trace: bool = True, **kwargs) -> Future:
+        """``_adopt_trace=False`` leaves the caller's trace alone when the call returns
+        (fan-out: only one account's marks go back into it)."""
+        fut = Future()
+        with self._lock:
+            if not self.alive:
+                fut.set_exception(ConnectionError(f"broker worker {self.broker} is not running"))
+                return fut
+            call_id = next(self._ids)
+            self._pending[call_id] = (fut, kwargs.get("trace") if _adopt_trace else None)
+            self._conn.send((call_id, fn, args, kwargs))
+        return fut
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+            if self.alive:
+                self._conn.send(None)
+
+class FanoutReport:
+    """One call's outcome on every fan-out account. Carries retcode/comment like an
+    order_send result (the first failure wins), so single-account callers work."""
+
+    def __init__(self, fn: str):
+        self.fn = fn
+        self.accounts = {}      # account -> {"retcode", "comment", "ms", "result"}
+        self.ms = 0.0           # until the last account answered (or the timeout)
+        self._lock = threading.Lock()
+
+    def done(self, account: str, t0: float, fut: Future):
+        ms = (time.perf_counter() - t0) * 1000
+        try:
+            res = fut.result()
+            rc, comment = getattr(res, "retcode", -2), getattr(res, "comment", "none")
+        except Exception as e:
+            res, rc, comment = None, -11, f"worker failed: {e}"
+        with self._lock:
+            self.accounts[account] = {"retcode": rc, "comment": comment, "ms": round(ms, 2), "result": res}
+        logging.info(f"[FANOUT] {account}: {self.fn} rc={rc} in {ms:.0f}ms")
+
+    def close(self, accounts, t0: float):
+        self.ms = (time.perf_counter() - t0) * 1000
+        with self._lock:
+            for account in accounts:
+                if account not in self.accounts:
+                    self.accounts[account] = {"retcode": -12, "comment": "still running",
+                                              "ms": round(self.ms, 2), "result": None}
+                    logging.warning(f"[FANOUT] {account}: no answer to {self.fn} after {self.ms:.0f}ms")
+
+    @property
+    def failed(self) -> list:
+        return [a for a, r in self.accounts.items() if r["retcode"] != 10009]    # TRADE_RETCODE_DONE
+
+    @property
+    def retcode(self) -> int:
+        failed = self.failed
+        return self.accounts[failed[0]]["retcode"] if failed else 10009
+
+    @property
+    def comment(self) -> str:
+        failed = self.failed
+        if failed:
+            return f"{len(failed)}/{len(self.accounts)} accounts failed: {failed[0]} {self.accounts[failed[0]]['comment']}"
+        return f"{len(self.accounts)} accounts done"
+
+    @property
+    def results(self) -> list:
+        """Per-ticket results of the accounts' BatchReports (closes / modifies)."""
+        return [r for a in self.accounts.values() for r in getattr(a["result"], "results", ())]
+
+class WorkerPool:
+    def __init__(self):
+        self.workers = {}       # broker -> BrokerWorker
+        self.active = None
+        self.fanout_accounts = []
+        self._tails = {}        # (account, symbol lane) -> future of the last call sent there
+        self._tails_lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return bool(self.workers)
+
+    @property
+    def primary(self) -> str:
+        """Where single-account calls go: the active broker, or with fan-out and no
+        worker for it, the first fan-out account."""
+        w = self.workers.get(self.active)
+        if (w is None or not w.ok) and self.fanout_accounts:
+            return self.fanout_accounts[0]
+        return self.active
+
+    def start(self, timeout: float = STARTUP_TIMEOUT) -> bool:
+        """Spawn one worker per standby broker and wait for them to log in.
+        True when the active broker's worker is ready."""
+        settings = config_store.settings()
+        data = config_store.broker_config()
+        fanout = [name for name in settings.get("fanout_accounts", ()) if name in data]
+        wanted = [name for name, cfg in data.items()
+                  if name != "active" and hasattr(cfg, "get") and (cfg.get("standby", True) or name in fanout)]
+        brokers = [name for name in wanted if data[name].get("terminal_path")]
+        skipped = [name for name in wanted if name not in brokers]
+        if skipped:
+            logging.warning(f"[WORKER] No terminal_path, no worker for: {skipped}")
+        terminals = {}
+        for name in brokers:
+            path = os.path.normcase(os.path.abspath(data[name]["terminal_path"]))
+            if path in terminals:
+                logging.error(f"[WORKER] {terminals[path]} and {name} share terminal {data[name]['terminal_path']}; "
+                              "each broker worker needs its own install")
+                return False
+            terminals[path] = name
+        mp = multiprocessing.get_context("spawn")
+        threads = settings.get("execution_workers", 4)
+        for name in brokers:
+            w = self.workers[name] = BrokerWorker(name, mp, threads)
+            w.start()
+        for w in self.workers.values():
+            w.ready.wait(timeout)
+        up = [n for n, w in self.workers.items() if w.ok]
+        logging.info(f"[WORKER] {len(up)}/{len(brokers)} broker workers ready: {up}")
+        self.active = data.get("active")
+        self.fanout_accounts = [name for name in fanout if name in up]
+        if fanout:
+            logging.info(f"[FANOUT] Signals go to {len(self.fanout_accounts)} accounts: {self.fanout_accounts}"
+                         + (f", not ready: {[n for n in fanout if n not in up]}" if len(self.fanout_accounts) < len(fanout) else ""))
+            return bool(self.fanout_accounts)
+        if self.active not in up:
+            logging.error(f"[WORKER] Active broker {self.active} has no ready worker")
+            return False
+        return True
+
+    def switch(self, broker: str) -> bool:
+        w = self.workers.get(broker)
+        if w is None or not w.ok or not w.alive:
+            logging.error(f"[WORKER] No ready worker for {broker}; staying on {self.active}")
+            return False
+        if broker != self.active:
+            logging.info(f"[WORKER] Routing orders {self.active} → {broker}")
+            self.active = broker
+        return True
+
+    def follow_config(self):
+        """Reroute to whatever mt5_credentials.json now names as active."""
+        broker = config_store.broker_config().get("active")
+        if broker and broker != self.active:
+            self.switch(broker)
+
+    def call(self, fn: str, *args, **kwargs):
+        return self.workers[self.primary].submit(fn, *args, **kwargs).result()
+
+    @staticmethod
+    def _lane(fn: str, args, kwargs):
+        """Execution-queue lane of a fan-out call: the symbol's alias-canonical key, or
+        None for calls on the whole account (flatten)."""
+        if "symbol" in kwargs:
+            symbol = kwargs["symbol"]
+        else:
+            i = 1 if fn == "send_order" else 0      # send_order(action, symbol, ...)
+            symbol = args[i] if len(args) > i else None
+        if not isinstance(symbol, str):
+            return None
+        from mt5_executor import symbol_key
+        return symbol_key(symbol)
+
+    def _submit_in_order(self, account: str, lane, fn: str, args, kwargs, adopt: bool) -> Future:
+        """Submit to ``account`` once its previous call on ``lane`` has finished; one that
+        outlived its fan-out may still be running in the worker."""
+        w = self.workers[account]
+        key = (account, lane)
+        with self._tails_lock:
+            prev = self._tails.get(key)
+            if prev is None or prev.done():
+                fut = w.submit(fn, *args, _adopt_trace=adopt, **kwargs)
+            else:
+                fut = Future()
+
+                def relay(inner: Future):
+                    if inner.exception() is not None:
+                        fut.set_exception(inner.exception())
+                    else:
+                        fut.set_result(inner.result())
+
+                logging.warning(f"[FANOUT] {account}: {fn} waits for the previous {lane} call")
+                prev.add_done_callback(
+                    lambda _: w.submit(fn, *args, _adopt_trace=adopt, **kwargs).add_done_callback(relay))
+            self._tails[key] = fut
+
+        def forget(done: Future):
+            with self._tails_lock:
+                if self._tails.get(key) is done:
+                    del self._tails[key]
+        fut.add_done_callback(forget)
+        return fut
+
+    def fanout(self, fn: str, *args, **kwargs) -> FanoutReport:
+        """``fn`` on every fan-out account in parallel; waits for the slowest up to
+        fanout_timeout_ms. The caller's trace picks up the primary account's marks."""
+        accounts = self.fanout_accounts
+        timeout = config_store.settings().get("fanout_timeout_ms", FANOUT_TIMEOUT * 1000) / 1000
+        primary = self.primary
+        report = FanoutReport(fn)
+        t0 = time.perf_counter()
+        futures = []
+        lane = self._lane(fn, args, kwargs)
+        for account in accounts:
+            fut = self._submit_in_order(account, lane, fn, args, kwargs, account == primary)
+            fut.add_done_callback(functools.partial(report.done, account, t0))
+            futures.append(fut)
+        wait(futures, timeout=timeout)
+        report.close(accounts, t0)
+        logging.info(f"[FANOUT] {fn} on {len(accounts)} accounts: last answer after {report.ms:.0f}ms, "
+                     f"{len(report.failed)} failed")
+        return report
+
+    def broadcast(self, fn: str, *args, **kwargs) -> dict:
+        """``fn`` on every live worker; broker -> result (or the exception raised)."""
+        futures = {n: w.submit(fn, *args, **kwargs) for n, w in self.workers.items() if w.ok and w.alive}
+        return {n: (f.exception() or f.result()) for n, f in futures.items()}
+
+    def stop(self):
+        for w in self.workers.values():
+            w.stop()
+
+pool = WorkerPool()
+
+def fans_out() -> bool:
+    """True when trading calls go to several accounts (each resolves symbols itself)."""
+    return pool.running and bool(pool.fanout_accounts)
+
+def call(fn: str, *args, **kwargs):
+    """Executor function ``fn`` on the active broker (its worker, or in process), or
+    on every fan-out account."""
+    if pool.running:
+        if fn in FANOUT and pool.fanout_accounts:
+            return pool.fanout(fn, *args, **kwargs)
+        return pool.call(fn, *args, **kwargs)
+    import mt5_executor
+    return getattr(mt5_executor, fn)(*args, **kwargs)
+
+def _routed(fn: str):
+    def route(*args, **kwargs):
+        return call(fn, *args, **kwargs)
+    route.__name__ = fn
+    return route
+
+send_order = _routed("send_order")
+close_pos = _routed("close_pos")
+flatten = _routed("flatten")
+modify_position = _routed("modify_position")
+modify_by_symbol = _routed("modify_by_symbol")
+resolve_symbol = _routed("resolve_symbol")
@@ -1,17 +1,25 @@
-import re, json, logging, pathlib, winsound, asyncio
-import hashlib
-import MetaTrader5 as mt5
+import logging, pathlib, winsound, asyncio
+from mt5_gateway import mt5
 from telethon import TelegramClient, events
 import traceback 
-from mt5_executor import modify_by_symbol, send_order, close_pos, modify_position, resolve_symbol, load_broker_creds
+from mt5_executor import load_broker_creds, symbol_key
+import mt5_workers
+# Executor calls go to the active broker's worker process when broker workers are on
+from mt5_workers import modify_by_symbol, send_order, close_pos, modify_position, resolve_symbol
+from utils.signal_grammar import parse_signal, OPEN, CLOSE, MODIFY, STATE
+from utils import config_store
+from utils.config_watcher import watch_files
+from utils.signal_queue import SignalQueue
+from utils.signal_coalescer import SignalCoalescer
+from utils.latency import Trace
 
 BASE_DIR      = pathlib.Path(__file__).parent
-SETTINGS_PATH = BASE_DIR / "config" / "settings.json"
-CRED_PATH     = BASE_DIR / "config" / "credentials.json"  
+SETTINGS_PATH = config_store.SETTINGS_PATH
+CRED_PATH     = config_store.CRED_PATH
 logging.getLogger("telethon").setLevel(logging.WARNING)
 
 # Load Telegram credentials (for client init)
-creds = json.load(open(CRED_PATH))
+creds = config_store.telegram_creds()
 client = TelegramClient('session', creds['api_id'], creds['api_hash'],
                         connection_retries=20,  
                         request_retries=20,     
@@ -23,171 +31,192 @@ def alert_sound():
     p = pathlib.Path(__file__).parent / "audio" / "error.wav"
     winsound.PlaySound(str(p), winsound.SND_FILENAME | winsound.SND_ASYNC)
     
-# Regex for buy/sell opens: match "Ich kaufe|verkaufe" or "I Buy/Sell", symbol, optional CALL/PUT + optional strike
-trade_re = re.compile(
-    r"(?:Ich\s+(Kaufe|Verkaufe)|I\s+(Buy|Sell))\s+"
-    r"([A-Za-z0-9/._]+)"                # symbol
-    r"(?:\s+(Call|Put)(?:\s*(\d+))?)?",   # optional CALL/PUT + optional strike
-    re.IGNORECASE
-)
+# Persistent SL/TP state
+state = {"sl": 0.0, "tp": 0.0}
 
-# Regex for closes
-close_re = re.compile(
-    r"(?:Ich\s+schließe|CLOSE)\s+"
-    r"([A-Za-z0-9/.]+)"                # symbol
-    r"(?:\s+(Call|Put)(?:\s*(\d+))?)?",   # optional CALL/PUT + optional strike
-    re.IGNORECASE
-)
+# Execution queue: parsing stays on the Telegram loop, MT5 calls run on worker
+# threads, one lane per symbol so signals for a symbol keep their order. Lanes run in
+# parallel because every terminal call goes through the single mt5_gateway thread
+_settings = config_store.settings()
+signal_queue = SignalQueue(maxsize=_settings.get("signal_queue_size", 64),
+                           workers=_settings.get("execution_workers", 4))
+# SL/TP and close bursts for one symbol are merged over a short window before execution
+coalescer = SignalCoalescer(signal_queue, window=_settings.get("coalesce_window_ms", 250) / 1000)
 
-# Regex for setting SL
-sl_symbol_re = re.compile(
-    r"Ich setze den SL bei\s+"
-    r"([A-Za-z0-9/.]+)"                # symbol
-    r"(?:\s+(Call|Put)(?:\s*(\d+))?)?"    # optional CALL/PUT + optional strike
-    r"\sauf\s([\d.]+)",           # SL price
-    re.IGNORECASE
-)
+def _tickets(res) -> int:
+    return len(getattr(res, "results", ()))
 
-tp_symbol_re = re.compile(
-    r"(?:Ich setze den TP bei)\s+([A-Za-z0-9/.]+)"  # symbol
-    r"(?:\s*(Call|Put))?\s*"                         # optional Call/Put
-    r"(?:\s*(\d+))?\sauf\s([\d.]+)",               # optional strike + TP price
-    re.IGNORECASE
-)
+# — Jobs run by the execution queue (worker threads) —
+def _resolve(symbol_txt: str):
+    try:
+        return resolve_symbol(symbol_txt)
+    except ValueError as e:
+        logging.error(e)
+        alert_sound()
+        return None
 
-# Inline SL/TP
-sl_re = re.compile(r"SL[: ]+([\d.]+)", re.IGNORECASE)
-tp_re = re.compile(r"TP[: ]+([\d.]+)", re.IGNORECASE)
+def _begin(trace: Trace, symbol_txt: str):
+    """Queue wait and symbol resolution as the first executor-side stages."""
+    trace.mark("queue")
+    if mt5_workers.fans_out():
+        # Brokers name symbols differently: each account's worker resolves the raw text
+        trace.symbol = symbol_txt
+        return symbol_txt
+    symbol = _resolve(symbol_txt)
+    trace.symbol = symbol or symbol_txt
+    trace.mark("resolve")
+    if symbol is None:
+        trace.finish("no symbol")
+    return symbol
 
-# Multiplier flag
-mult_re = re.compile(r"maximalen Multiplikator", re.IGNORECASE)
+def execute_open(sig, sl: float, tp: float, trace: Trace):
+    action, opt, strike = sig.action, sig.opt, sig.strike
+    symbol = _begin(trace, sig.symbol)
+    if symbol is None:
+        return None
+    logging.info(f"[SIGNAL] OPEN {action.upper()} {symbol} {opt or ''} strike={_strike_txt(strike)} ×{'MAX' if sig.use_max else 'std'}")
+    # Send the order at market price
+    res = send_order(
+        action=action,
+        symbol=symbol,
+        price=0,
+        sl=sl,
+        tp=tp,
+        multiplier=sig.use_max,
+        opt=opt,
+        strike=strike,
+        trace=trace
+    )
+    trace.finish(res.retcode)
+    if res.retcode != mt5.TRADE_RETCODE_DONE:
+        logging.error(f"OPEN failed: {res.comment}")
+        alert_sound()
+    return res
 
-# Call/Put detector
-put_call_re = re.compile(r"\b(call|put)\b", re.IGNORECASE)
+def execute_close(sig, trace: Trace, cancelled: int = 0):
+    symbol = _begin(trace, sig.symbol)
+    if symbol is None:
+        return None
+    logging.info(f"[SIGNAL] CLOSE {symbol} {sig.opt or ''} strike={_strike_txt(sig.strike)}")
+    res = close_pos(symbol, trace=trace)
+    coalescer.saved(cancelled * _tickets(res))  # The cancelled MODIFYs would have hit these tickets
+    trace.finish(res.retcode)
+    if res.retcode != mt5.TRADE_RETCODE_DONE:
+        logging.error(f"CLOSE failed: {res.comment}")
+        alert_sound()
+    return res
 
-# Persistent SL/TP state
-state = {"sl": 0.0, "tp": 0.0}
+def execute_modify(sig, trace: Trace, merged: int = 1):
+    symbol = _begin(trace, sig.symbol)
+    if symbol is None:
+        return None
+    what = _levels_txt(sig)
+    logging.info(f"[SIGNAL] SET {what} ALL {symbol} {sig.opt or ''} strike={_strike_txt(sig.strike)} → SL={sig.sl} TP={sig.tp}")
+    levels = {k: v for k, v in (("sl", sig.sl), ("tp", sig.tp)) if v is not None}
+    res = modify_by_symbol(symbol, **levels, trace=trace)
+    coalescer.saved((merged - 1) * _tickets(res))
+    trace.finish(getattr(res, "retcode", None))
+    if not res or getattr(res, "retcode", None) != mt5.TRADE_RETCODE_DONE:
+        logging.error(f"[MT5] {what} modify failed for {symbol}: {getattr(res, 'retcode', 'unknown')} {getattr(res, 'comment', '')}")
+        alert_sound()
+    return res
 
 # The event handler (without decorator - will be added dynamically)
 async def the_handler(event):
+    trace = Trace("signal", event.date)
     msg = event.raw_text.strip()
-    settings = json.load(open(SETTINGS_PATH))  # Reload in case changed, but usually static
+    settings = config_store.settings()  # Cached snapshot, re-read only when the file changes
     logging.info("[TG] Msg from chat %s: %r" % (event.chat_id, msg))
-    # Determine multiplier and active broker
-    use_max = bool(mult_re.search(msg))
+    # One pass over the message: command, symbol, side, option, strike, SL/TP
+    sig = parse_signal(msg)
+    trace.kind = sig.kind
+    trace.mark("parse")
     active, _ = load_broker_creds()
     # 1) OPEN trade
-    if m := trade_re.search(msg):
-        verb = (m.group(1) or m.group(2)).lower()
-        symbol_txt, opt, strike = m.group(3), m.group(4), m.group(5)
-        if opt: opt = m.group(4).lower()
-        action = 'buy' if verb in ('kaufe','buy') else 'sell'
+    if sig.kind == OPEN:
         # If buy at Put then this is sell !!  (however SL/TP settings don't fit -> better deactivate PUT_CALL) 
-        if (opt == 'put' and verb in ('kaufe', 'buy')): action = 'sell'
         # Check if PUT/CALL and setting / Ignore Put/Call at sell
-        if (opt or put_call_re.search(msg)) and (not settings['accept_PUT_CALL'] or (settings['accept_PUT_CALL'] and verb in ('verkaufe','sell'))):
-            logging.info(f"[SIGNAL] Ignored OPEN {action.upper()} {symbol_txt} {opt or ''} strike={strike or '—'} because accept_PUT_CALL is False or it's a sell")
+        if (sig.opt or sig.has_put_call) and (not settings['accept_PUT_CALL'] or (settings['accept_PUT_CALL'] and sig.side == 'sell')):
+            logging.info(f"[SIGNAL] Ignored OPEN {sig.action.upper()} {sig.symbol} {sig.opt or ''} strike={_strike_txt(sig.strike)} because accept_PUT_CALL is False or it's a sell")
             return
-        # Resolve symbol
-        try:
-            symbol = resolve_symbol(symbol_txt)
-        except ValueError as e:
-            logging.error(e)
-            alert_sound()
-            return
-        logging.info(f"[SIGNAL] OPEN {action.upper()} {symbol} {opt or ''} strike={strike or '—'} ×{'MAX' if use_max else 'std'}")
-        # Send the order at market price
-        res = send_order(
-            action=action,
-            symbol=symbol,
-            price=0,
-            sl=state['sl'],
-            tp=state['tp'],
-            multiplier=use_max,
-            opt=opt,
-            strike=float(strike) if strike else None
-        )
-        if res.retcode != mt5.TRADE_RETCODE_DONE:
-            logging.error(f"OPEN failed: {res.comment}")
-            alert_sound()
+        # SL/TP are taken now, so a later STATE message can't change a queued order
+        await coalescer.before_open(symbol_key(sig.symbol))
+        await signal_queue.submit(symbol_key(sig.symbol), execute_open, sig, state['sl'], state['tp'], trace)
         return
     # 2) CLOSE trade
-    if m := close_re.search(msg):
-        symbol_txt, opt, strike = m.group(1), m.group(2), m.group(3)
+    if sig.kind == CLOSE:
         # Check if PUT/CALL and setting
-        if (opt or put_call_re.search(msg)) and not settings['accept_PUT_CALL']:
-            logging.info(f"[SIGNAL] Ignored CLOSE {symbol_txt} {opt or ''} strike={strike or '—'} because accept_PUT_CALL is False")
-            return
-        try:
-            symbol = resolve_symbol(symbol_txt)
-        except ValueError as e:
-            logging.error(e)
-            alert_sound()
+        if (sig.opt or sig.has_put_call) and not settings['accept_PUT_CALL']:
+            logging.info(f"[SIGNAL] Ignored CLOSE {sig.symbol} {sig.opt or ''} strike={_strike_txt(sig.strike)} because accept_PUT_CALL is False")
             return
-        logging.info(f"[SIGNAL] CLOSE {symbol} {opt or ''} strike={strike or '—'}")
-        res = close_pos(symbol)
-        if res.retcode != mt5.TRADE_RETCODE_DONE:
-            logging.error(f"CLOSE failed: {res.comment}")
-            alert_sound()
+        await coalescer.close(symbol_key(sig.symbol), sig, trace, execute_close)
         return
-    if m := sl_symbol_re.search(msg):
-        symbol_txt, opt, strike, slv = m.group(1), m.group(2), m.group(3), float(m.group(4))
-        # Check if PUT/CALL and setting
-        if (opt or put_call_re.search(msg)) and not settings['accept_PUT_CALL']:
-            logging.info(f"[SIGNAL] Ignored SET SL ALL {symbol_txt} {opt or ''} strike={strike or '—'} because accept_PUT_CALL is False")
-            return
-        try:
-            symbol = resolve_symbol(symbol_txt)
-        except ValueError as e:
-            logging.error(e)
-            alert_sound()
-            return
-        logging.info(f"[SIGNAL] SET SL ALL {symbol} {opt or ''} strike={strike or '—'} → {slv}")
-        res = modify_by_symbol(symbol, sl=slv)
-        if not res or getattr(res, "retcode", None) != mt5.TRADE_RETCODE_DONE:
-            logging.error(f"[MT5] SL modify failed for {symbol}: {getattr(res, 'retcode', 'unknown')} {getattr(res, 'comment', '')}")
-            alert_sound()
-            return
-    if m := tp_symbol_re.search(msg):
-        sym_txt, opt, strike, tpv = m.group(1), m.group(2), m.group(3), float(m.group(4))
-        # Check if PUT/CALL and setting
-        if (opt or put_call_re.search(msg)) and not settings['accept_PUT_CALL']:
-            logging.info(f"[SIGNAL] Ignored MOD TP ALL {sym_txt} {opt or ''} strike={strike or '—'} because accept_PUT_CALL is False")
-            return
-        try:
-            symbol = resolve_symbol(sym_txt)
-        except ValueError as e:
-            logging.error(e)
-            alert_sound()
-            return
-        logging.info(f"[SIGNAL] MOD TP ALL {symbol} {opt or ''} strike={strike or '—'} → {tpv}")
-        res = modify_by_symbol(symbol, tp=tpv)
-        if not res or getattr(res, "retcode", None) != mt5.TRADE_RETCODE_DONE:
-            logging.error(f"[MT5] TP modify failed for {symbol}: {getattr(res, 'retcode', 'unknown')} {getattr(res, 'comment', '')}")
-            alert_sound()
-            return
-    if m := sl_re.search(msg):
-        if put_call_re.search(msg) and not settings['accept_PUT_CALL']:
-            logging.info(f"[SIGNAL] Ignored STATE SL because contains CALL/PUT and accept_PUT_CALL is False")
-            return
-        state['sl'] = float(m.group(1))
-        logging.info(f"[SIGNAL] STATE SL={state['sl']}")
+    # 3) SL/TP for all positions of a symbol (and of a second one, when SL and TP name different symbols)
+    if sig.kind == MODIFY:
+        for mod in (sig, *sig.also):
+            if mod is not sig:
+                # Its own trace: the two modifies run on different lanes
+                trace = Trace("signal", event.date)
+                trace.kind = mod.kind
+                trace.mark("parse")
+            # Check if PUT/CALL and setting
+            if (mod.opt or mod.has_put_call) and not settings['accept_PUT_CALL']:
+                logging.info(f"[SIGNAL] Ignored SET {_levels_txt(mod)} ALL {mod.symbol} {mod.opt or ''} strike={_strike_txt(mod.strike)} because accept_PUT_CALL is False")
+                continue
+            await coalescer.modify(symbol_key(mod.symbol), mod, trace, execute_modify)
         return
-    if m := tp_re.search(msg):
-        if put_call_re.search(msg) and not settings['accept_PUT_CALL']:
-            logging.info(f"[SIGNAL] Ignored STATE TP because contains CALL/PUT and accept_PUT_CALL is False")
+    # 4) SL/TP remembered for the next OPEN
+    if sig.kind == STATE:
+        if sig.has_put_call and not settings['accept_PUT_CALL']:
+            logging.info(f"[SIGNAL] Ignored STATE {'SL' if sig.sl is not None else 'TP'} because contains CALL/PUT and accept_PUT_CALL is False")
             return
-        state['tp'] = float(m.group(1))
-        logging.info(f"[SIGNAL] STATE TP={state['tp']}")
+        if sig.sl is not None:
+            state['sl'] = sig.sl
+            logging.info(f"[SIGNAL] STATE SL={state['sl']}")
+        else:
+            state['tp'] = sig.tp
+            logging.info(f"[SIGNAL] STATE TP={state['tp']}")
         return
     logging.debug("[TG] no match")
 
+def _levels_txt(sig) -> str:
+    return " ".join(name for name, v in (("SL", sig.sl), ("TP", sig.tp)) if v is not None)
+
+def _strike_txt(strike) -> str:
+    return f"{strike:g}" if strike is not None else "—"
+
+# Chats the handler currently listens to, and titles of every chat resolved so far.
+# The handler is registered once and filters on this set, so re-subscribing is a set
+# swap: no window where it is removed, and no get_entity for chats already known.
+listened_chats: frozenset = frozenset()
+entity_cache: dict = {}   # chat id -> title
+_handler_added = False
+
+def _listening(event) -> bool:
+    return event.chat_id in listened_chats
+
+async def _resolve_chat(gid: int):
+    if gid in entity_cache:
+        return gid
+    try:
+        entity = await client.get_entity(gid)
+        entity_cache[gid] = getattr(entity, "title", None) or getattr(entity, "username", None) or str(gid)
+        return gid
+    except ValueError as e:
+        logging.warning(f"[TG] Could not access channel id {gid} (not in dialogs or access denied): {e}")
+    except Exception as e:
+        logging.warning(f"[TG] Unexpected error resolving channel id {gid}: {e}")
+    return None
+
 async def update_listener_chats():
-    client.remove_event_handler(the_handler, events.NewMessage)
-    creds = json.load(open(CRED_PATH))
+    global listened_chats, _handler_added
+    if not _handler_added:
+        client.add_event_handler(the_handler, events.NewMessage(func=_listening))
+        _handler_added = True
+    creds = config_store.telegram_creds()
     group_ids_full = [int(gid.strip()) for gid in creds.get('group_ids', []) if gid.strip()]
     active_group_index = creds.get('active_group_index', 0)
-    settings = json.load(open(SETTINGS_PATH))
+    settings = config_store.settings()
     listen_to_all = settings.get('listen_to_all_channels', True)
     
     # Determine potential chats
@@ -201,42 +230,33 @@ async def update_listener_chats():
             potential_chats = []
             logging.warning("[TG] Config update: No active channel selected (invalid index)")
     
-    if not potential_chats:
-        logging.warning("[TG] No channels to listen to after update. No handler added.")
+    wanted = set(potential_chats)
+    if not wanted:
+        logging.warning("[TG] No channels to listen to after update.")
+    removed = listened_chats - wanted
+    added = wanted - listened_chats
+    if not added and not removed:
         return
-    valid_chats = []
-    for gid in potential_chats:
-        try:
-            entity = await client.get_entity(gid)
-            title = getattr(entity, "title", None) or getattr(entity, "username", None) or str(gid)
-            valid_chats.append(gid)
-        except ValueError as e:
-            logging.warning(f"[TG] Could not access channel id {gid} (not in dialogs or access denied): {e}")
-        except Exception as e:
-            logging.warning(f"[TG] Unexpected error resolving channel id {gid}: {e}")
-    
-    if not valid_chats:
-        logging.error("[TG] No accessible channels after update. Check your membership/access. No handler added.")
-        return
-    # Add the event handler for valid chats
-    client.add_event_handler(the_handler, events.NewMessage(chats=valid_chats))
-
-def config_hash(paths):
-    m = hashlib.md5()
-    for p in paths:
-        with open(p, 'rb') as f:
-            m.update(f.read())
-    return m.hexdigest()
+    # Resolve only the new chats, all at once
+    resolved = await asyncio.gather(*(_resolve_chat(gid) for gid in added))
+    valid_added = {gid for gid in resolved if gid is not None}
+    listened_chats = frozenset((listened_chats - removed) | valid_added)
+    for gid in removed:
+        logging.info(f"[TG] Stopped listening to {entity_cache.get(gid, gid)}")
+    for gid in valid_added:
+        logging.info(f"[TG] Listening to {entity_cache[gid]} ({gid})")
+    if not listened_chats:
+        logging.error("[TG] No accessible channels after update. Check your membership/access.")
 
 async def monitor_config():
-    last = config_hash([CRED_PATH, SETTINGS_PATH])
-    while True:
-        await asyncio.sleep(10)
-        now = config_hash([CRED_PATH, SETTINGS_PATH])
-        if now != last:
-            logging.info("Config changed -> updating")
+    async for changed in watch_files([CRED_PATH, SETTINGS_PATH, config_store.MT5_CRED_PATH]):
+        logging.info(f"Config changed ({', '.join(p.name for p in changed)}) -> updating")
+        if config_store.MT5_CRED_PATH.resolve() in changed and mt5_workers.pool.running:
+            mt5_workers.pool.follow_config()  # e.g. the dashboard switched the active broker
+        try:
             await update_listener_chats()
-            last = now
+        except Exception as e:
+            logging.error(f"[TG] Listener update failed: {e}")
             
 async def run_listener():
     monitor_task = None
@@ -263,10 +283,12 @@ async def run_listener():
             break
         finally:
             if monitor_task:
+                monitor_task.cancel()
                 try:
                     await monitor_task  
+                except asyncio.CancelledError:
+                    pass
                 except Exception as e:
                     logging.error(f"Monitor config task failed: {e}. Traceback: {traceback.format_exc()}")
-                monitor_task.cancel()
             await client.disconnect()
         first_attempt = False
\ No newline at end of file
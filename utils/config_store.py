@@ -0,0 +1,113 @@
+import json
+import os
+import pathlib
+import threading
+from types import MappingProxyType
+
+# — Paths —
+BASE_DIR          = pathlib.Path(__file__).parent.parent
+SETTINGS_PATH     = BASE_DIR / "config" / "settings.json"
+CRED_PATH         = BASE_DIR / "config" / "credentials.json"
+MT5_CRED_PATH     = BASE_DIR / "config" / "mt5_credentials.json"
+LEVERAGE_RULES_PATH = BASE_DIR / "config" / "leverage_rules.json"
+MARGIN_TIERS_PATH = BASE_DIR / "config" / "margin_tiers.json"
+LEVERAGE_MAPS_DIR = BASE_DIR / "leverage_maps"
+
+# — Snapshot cache —
+# Each file is parsed once and handed out as a read-only snapshot. A snapshot is
+# re-read only when the file's mtime or size changes, so the hot path pays one
+# stat() per file instead of an open() + json parse.
+_cache: dict = {}        # path -> ((mtime_ns, size), snapshot)
+_lock = threading.Lock()
+
+def freeze(obj):
+    """Deep read-only copy of parsed JSON: dicts become mappingproxies, lists tuples."""
+    if isinstance(obj, dict):
+        return MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+def thaw(obj):
+    """Mutable copy of a snapshot, for callers that edit and save a config."""
+    if isinstance(obj, MappingProxyType):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, tuple):
+        return [thaw(v) for v in obj]
+    return obj
+
+def _stamp(path: pathlib.Path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def snapshot(path) -> MappingProxyType:
+    """Current contents of a JSON file. Raises like open()/json.load() would."""
+    path = pathlib.Path(path)
+    stamp = _stamp(path)
+    hit = _cache.get(path)
+    if hit and hit[0] == stamp:
+        return hit[1]
+    with _lock:
+        hit = _cache.get(path)
+        if hit and hit[0] == stamp:
+            return hit[1]
+        with open(path, encoding="utf-8") as f:
+            data = freeze(json.load(f))
+        # The stamp predates the read, so a write racing it just costs one extra reload
+        _cache[path] = (stamp, data)
+        return data
+
+def invalidate(path=None):
+    with _lock:
+        if path is None:
+            _cache.clear()
+        else:
+            _cache.pop(pathlib.Path(path), None)
+
+# A broker worker process serves one broker whatever "active" says in the file
+_pinned_broker: str = None
+
+def pin_broker(name: str):
+    global _pinned_broker
+    _pinned_broker = name
+
+def active_broker() -> str:
+    """The broker this process trades: the pinned one, else "active" in mt5_credentials.json."""
+    return _pinned_broker or broker_config().get("active")
+
+def settings() -> MappingProxyType:
+    """settings.json, overlaid in a pinned broker process with the broker's
+    "settings_profile" file (sizing keys for that account)."""
+    base = snapshot(SETTINGS_PATH)
+    if _pinned_broker is None:
+        return base
+    name = broker_config().get(_pinned_broker, {}).get("settings_profile")
+    if not name:
+        return base
+    return _overlay(base, snapshot(BASE_DIR / "config" / name))
+
+_overlaid = (None, None, None)  # (base, profile, merged) for the last overlay built
+
+def _overlay(base, profile):
+    global _overlaid
+    b, p, merged = _overlaid
+    if b is base and p is profile:
+        return merged
+    merged = MappingProxyType({**base, **profile})
+    _overlaid = (base, profile, merged)
+    return merged
+
+def telegram_creds() -> MappingProxyType:
+    return snapshot(CRED_PATH)
+
+def broker_config() -> MappingProxyType:
+    return snapshot(MT5_CRED_PATH)
+
+def leverage_map(file_name: str) -> MappingProxyType:
+    return snapshot(LEVERAGE_MAPS_DIR / file_name)
+
+def leverage_rules() -> MappingProxyType:
+    return snapshot(LEVERAGE_RULES_PATH)
+
+def margin_tiers() -> MappingProxyType:
+    return snapshot(MARGIN_TIERS_PATH)
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import os
+import pathlib
+
+# watchdog gives us OS change notifications (inotify / ReadDirectoryChangesW);
+# without it we fall back to cheap stat() polling.
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+POLL_INTERVAL = 0.1    # seconds between stat() checks when polling
+DEBOUNCE      = 0.05   # editors often write a file in several steps
+
+def _stamp(path: pathlib.Path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except FileNotFoundError:
+        return None
+
+async def watch_files(paths, poll_interval: float = POLL_INTERVAL, debounce: float = DEBOUNCE):
+    """Async generator yielding the set of paths whose mtime/size changed."""
+    paths = [pathlib.Path(p).resolve() for p in paths]
+    stamps = {p: _stamp(p) for p in paths}
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    observer = None
+    if Observer is not None:
+        watched = set(paths)
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                touched = {getattr(event, "src_path", None), getattr(event, "dest_path", None)}
+                if any(t and pathlib.Path(t).resolve() in watched for t in touched):
+                    loop.call_soon_threadsafe(wake.set)
+
+        observer = Observer()
+        for d in {p.parent for p in paths}:
+            observer.schedule(_Handler(), str(d), recursive=False)
+        observer.daemon = True
+        observer.start()
+        logging.info("[CFG] Watching config files via OS notifications")
+    else:
+        logging.info(f"[CFG] watchdog not installed, polling config files every {poll_interval}s")
+    try:
+        while True:
+            if observer is not None:
+                await wake.wait()
+            else:
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            wake.clear()
+            if observer is not None:
+                await asyncio.sleep(debounce)
+                wake.clear()
+            changed = set()
+            for p in paths:
+                now = _stamp(p)
+                if now != stamps[p]:
+                    stamps[p] = now
+                    changed.add(p)
+            if changed:
+                yield changed
+    finally:
+        if observer is not None:
+            observer.stop()
@@ -0,0 +1,114 @@
+import json
+import logging
+import pathlib
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+
+# — Signal latency tracing —
+# A Trace follows one signal from the Telegram message timestamp to the final MT5
+# retcode. Each mark() closes a stage: its duration is the time since the previous
+# mark. Finished traces feed rolling per-stage / per-symbol samples and are appended,
+# one compact JSON line each, to latency/<YYYY-MM-DD>.jsonl.
+
+LATENCY_DIR = pathlib.Path(__file__).parent.parent / "latency"
+WINDOW = 1024            # samples kept per (stage, symbol)
+
+# perf_counter has sub-microsecond resolution on every platform; anchor it to the
+# wall clock once so marks can be compared with Telegram's message timestamps
+_WALL0, _PERF0 = time.time(), time.perf_counter()
+
+def now() -> float:
+    return _WALL0 + (time.perf_counter() - _PERF0)
+
+_samples = defaultdict(lambda: deque(maxlen=WINDOW))   # (stage, symbol) -> ms values
+_lock = threading.Lock()
+
+class Trace:
+    __slots__ = ("kind", "symbol", "stages", "retcode", "attempts", "_last", "_start")
+
+    def __init__(self, kind: str, message_time: datetime = None):
+        self.kind = kind
+        self.symbol = None
+        self.stages = []        # [(stage, ms)] in order; a stage may repeat (order_send)
+        self.retcode = None
+        self.attempts = 0
+        t = now()
+        self._start = t
+        if message_time is not None:
+            # Telegram dates have one-second resolution; never report negative delivery
+            sent = message_time.timestamp()
+            self.stages.append(("telegram", max(t - sent, 0.0) * 1000))
+            self._start = min(sent, t)
+        self._last = t
+
+    def mark(self, stage: str):
+        t = now()
+        self.stages.append((stage, (t - self._last) * 1000))
+        self._last = t
+        if stage == "order_send":
+            self.attempts += 1
+
+    def finish(self, retcode=None):
+        self.retcode = retcode
+        total = (now() - self._start) * 1000
+        record(self.stages + [("total", total)], self.symbol or "?")
+        _append(self, total)
+        logging.detailed(f"[LATENCY] {self.kind} {self.symbol} rc={retcode} total={total:.1f}ms "
+                         + " ".join(f"{s}={ms:.1f}" for s, ms in self.stages))
+
+class _NoTrace:
+    """Stand-in when a caller has no trace; every call is a no-op."""
+    kind = symbol = retcode = None
+    attempts = 0
+
+    def __setattr__(self, name, value):
+        pass
+
+    def mark(self, stage: str):
+        pass
+
+    def finish(self, retcode=None):
+        pass
+
+NO_TRACE = _NoTrace()
+
+def record(stages, symbol: str):
+    with _lock:
+        for stage, ms in stages:
+            _samples[(stage, symbol)].append(ms)
+            _samples[(stage, "*")].append(ms)
+
+def _percentile(sorted_vals, q: float) -> float:
+    i = min(int(q * len(sorted_vals)), len(sorted_vals) - 1)
+    return sorted_vals[i]
+
+def summary(symbol: str = "*") -> dict:
+    """{stage: {n, p50, p95, p99}} in ms over the rolling window, for one symbol or
+    all of them ("*")."""
+    with _lock:
+        snap = {stage: list(vals) for (stage, sym), vals in _samples.items() if sym == symbol}
+    out = {}
+    for stage, vals in snap.items():
+        vals.sort()
+        out[stage] = {"n": len(vals), "p50": _percentile(vals, 0.50),
+                      "p95": _percentile(vals, 0.95), "p99": _percentile(vals, 0.99)}
+    return out
+
+def symbols() -> list:
+    with _lock:
+        return sorted({sym for _, sym in _samples if sym != "*"})
+
+def _append(trace: Trace, total: float):
+    line = {"t": round(trace._start, 3), "k": trace.kind, "s": trace.symbol, "rc": trace.retcode,
+            "n": trace.attempts, "ms": round(total, 2),
+            "st": [[s, round(ms, 2)] for s, ms in trace.stages]}
+    path = LATENCY_DIR / f"{datetime.now():%Y-%m-%d}.jsonl"
+    try:
+        with _lock:
+            LATENCY_DIR.mkdir(exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(line, separators=(",", ":")) + "\n")
+    except OSError as e:
+        logging.warning(f"[LATENCY] Could not write {path}: {e}")
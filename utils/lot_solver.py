@@ -0,0 +1,78 @@
+import math
+
+# — Max feasible lot —
+# Margin and the commission buffer both grow with volume, so the largest lot that fits
+# the free margin can be solved for instead of searched: one margin sample at the
+# requested lot gives the per-lot rate, the linear estimate is snapped down to the
+# volume step and checked with a second sample. Tiered margin grows faster than
+# linearly, which only makes the estimate conservative; secant steps between the
+# feasible estimate and the infeasible request then close the gap. When they stall
+# (a step that rounds back onto the feasible end), or the estimate fails its check,
+# a bisection over the step grid finishes the search.
+
+def snap(lot: float, step: float) -> float:
+    """Round ``lot`` down to a multiple of ``step`` (tolerating float noise)."""
+    return round(math.floor(lot / step + 1e-9) * step, 8)
+
+def max_feasible_lot(margin_of, commission_of, lot: float, free_margin: float,
+                     step: float, vmin: float, max_samples: int = 16):
+    """Largest lot <= ``lot``, on the ``step`` grid and >= ``vmin``, such that
+    margin_of(l) + commission_of(l) <= free_margin. ``commission_of`` must be cheap
+    and affine in the lot; ``margin_of`` is the expensive call.
+
+    Returns (lot, margin at that lot, margin samples taken); lot is 0.0 if even
+    ``vmin`` does not fit.
+    """
+    samples = 0
+
+    def cost(l):
+        nonlocal samples
+        samples += 1
+        m = margin_of(l)
+        return m, (None if m is None else m + commission_of(l))
+
+    m_hi, cost_hi = cost(lot)
+    if cost_hi is not None and cost_hi <= free_margin:
+        return lot, m_hi, samples
+    if not m_hi or m_hi <= 0 or lot <= 0:
+        return 0.0, None, samples
+
+    # Linear estimate from the first sample
+    c0 = commission_of(0.0)
+    est = max(min(snap((free_margin - c0) / ((cost_hi - c0) / lot), step), snap(lot - step, step)), vmin)
+    m_lo, cost_lo = cost(est)
+    if cost_lo is not None and cost_lo <= free_margin:
+        # Secant (Illinois) steps between the feasible estimate and the infeasible request
+        lo, hi = est, lot
+        g_lo, g_hi = cost_lo - free_margin, cost_hi - free_margin
+        while samples < max_samples and g_hi > g_lo:
+            cand = snap(lo - g_lo / (g_hi - g_lo) * (hi - lo), step)
+            cand = min(cand, snap(hi - step, step))
+            if cand <= lo:
+                # Stalled on lo (convex margin undershoots): probe the next grid lot
+                cand = round(lo + step, 8)
+                if cand >= hi:
+                    break
+            m, c = cost(cand)
+            if c is None:
+                break
+            if c <= free_margin:
+                lo, m_lo, g_lo = cand, m, c - free_margin
+                g_hi /= 2    # keep a far infeasible end from stalling the steps
+            else:
+                hi, g_hi = cand, c - free_margin
+        lo_i, hi_i, best = round(lo / step), round(hi / step), (lo, m_lo)
+    elif est <= vmin:
+        return 0.0, None, samples
+    else:
+        lo_i, hi_i, best = math.ceil(vmin / step - 1e-9) - 1, round(est / step), (0.0, None)
+
+    # Bisect over grid indices: lo fits (or is below vmin), hi does not
+    while hi_i - lo_i > 1 and samples < max_samples:
+        mid = (lo_i + hi_i) // 2
+        m, c = cost(round(mid * step, 8))
+        if c is not None and c <= free_margin:
+            lo_i, best = mid, (round(mid * step, 8), m)
+        else:
+            hi_i = mid
+    return best[0], best[1], samples
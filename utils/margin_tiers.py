@@ -0,0 +1,89 @@
+import logging
+import threading
+from bisect import bisect_right
+from utils import config_store
+
+# — Tiered margin —
+# Some brokers charge margin on a symbol's aggregate nominal in tiers: the first 50k
+# at 1:200, the next 450k at 1:100 and so on. A schedule is compiled once into tier
+# lower bounds and the cumulative margin at each bound, so the margin of any nominal
+# is one bisect plus one division, and the margin a new order adds on top of the
+# existing aggregate is the difference of two such lookups.
+
+class TierSchedule:
+    def __init__(self, tiers):
+        """``tiers``: [(low, high, leverage)] in ascending, contiguous order; a high of
+        None means unbounded."""
+        self.lows = []
+        self.levs = []
+        self.cum = []           # margin for the nominal up to lows[i]
+        total = 0.0
+        prev_high = None
+        for low, high, lev in tiers:
+            low = float(low)
+            if prev_high is not None and low != prev_high:
+                raise ValueError(f"tiers are not contiguous at {low}")
+            self.lows.append(low)
+            self.levs.append(float(lev))
+            self.cum.append(total)
+            high = float("inf") if high is None else float(high)
+            if high != float("inf"):
+                total += (high - low) / float(lev)
+            prev_high = high
+
+    def margin(self, nominal: float) -> float:
+        if nominal <= 0 or not self.lows:
+            return 0.0
+        i = bisect_right(self.lows, nominal) - 1
+        if i < 0:
+            return 0.0
+        return self.cum[i] + (nominal - self.lows[i]) / self.levs[i]
+
+    def incremental(self, current: float, added: float) -> float:
+        """Margin added by ``added`` nominal on top of an existing ``current`` aggregate."""
+        return self.margin(current + added) - self.margin(current)
+
+    def incremental_many(self, current: float, added) -> list:
+        base = self.margin(current)
+        return [self.margin(current + a) - base for a in added]
+
+# — Per-broker schedules from config/margin_tiers.json —
+# {"brokers": {<text in broker name or server>: {<SYMBOL>: <schedule name>}},
+#  "schedules": {<schedule name>: [[low, high, leverage], ...]}}
+
+_compiled = {}              # schedule name -> TierSchedule
+_source = None              # config snapshot _compiled was built from
+_lock = threading.Lock()
+
+def _schedules():
+    global _compiled, _source
+    try:
+        conf = config_store.margin_tiers()
+    except FileNotFoundError:
+        return {}, {}
+    except ValueError as e:
+        logging.error(f"[Margin Calc] Cannot read {config_store.MARGIN_TIERS_PATH.name}: {e}")
+        return {}, {}
+    if _source is not conf:
+        with _lock:
+            if _source is not conf:
+                compiled = {}
+                for name, tiers in conf.get("schedules", {}).items():
+                    try:
+                        compiled[name] = TierSchedule(tiers)
+                    except (TypeError, ValueError) as e:
+                        logging.error(f"[Margin Calc] Bad tier schedule '{name}': {e}")
+                _compiled, _source = compiled, conf
+    return _compiled, conf
+
+def schedule_for(broker: str, server: str, symbol: str) -> TierSchedule:
+    """Tier schedule for ``symbol`` on this broker, or None when margin is flat."""
+    compiled, conf = _schedules()
+    where = f"{broker} {server}".lower()
+    sym = symbol.upper()
+    for text, symbols in conf.get("brokers", {}).items():
+        if text.lower() in where:
+            name = symbols.get(sym)
+            if name:
+                return compiled.get(name)
+    return None
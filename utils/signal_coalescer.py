@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import time
+
+# — Coalescing of bursty SL/TP / close signals —
+# Channels often post the SL and the TP for a symbol a moment apart, or edit a message
+# twice. A MODIFY is held for ``window`` seconds per symbol; further MODIFYs in that
+# window merge into it (later levels win, unmentioned ones are kept), so the executor
+# sends one TRADE_ACTION_SLTP per ticket. A CLOSE in the window cancels the pending
+# MODIFY, and a repeated CLOSE inside the window is dropped. An OPEN flushes the pending
+# MODIFY first, so it never applies to the position the OPEN creates, and ends the
+# repeated-CLOSE window.
+
+class SignalCoalescer:
+    def __init__(self, queue, window: float = 0.25):
+        self.queue = queue
+        self.window = window
+        self._pending = {}      # key -> {"sig", "trace", "job", "merged", "handle"}
+        self._closed_at = {}    # key -> monotonic time of the last CLOSE submitted
+        self.stats = {"modifies_merged": 0, "modifies_cancelled": 0, "closes_dropped": 0, "calls_saved": 0}
+
+    async def modify(self, key: str, sig, trace, job):
+        """Hold (or merge) a MODIFY; ``job(sig, trace, merged)`` runs when the window ends."""
+        if self.window <= 0:
+            await self.queue.submit(key, job, sig, trace, 1)
+            return
+        pending = self._pending.get(key)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            handle = loop.call_later(self.window, lambda: loop.create_task(self.flush(key)))
+            self._pending[key] = {"sig": sig, "trace": trace, "job": job, "merged": 1, "handle": handle}
+            return
+        prev = pending["sig"]
+        pending["sig"] = prev._replace(sl=prev.sl if sig.sl is None else sig.sl,
+                                       tp=prev.tp if sig.tp is None else sig.tp)
+        pending["merged"] += 1
+        self.stats["modifies_merged"] += 1
+        logging.detailed(f"[COALESCE] {key}: merged MODIFY #{pending['merged']} → SL={pending['sig'].sl} TP={pending['sig'].tp}")
+
+    async def flush(self, key: str):
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        pending["handle"].cancel()
+        await self.queue.submit(key, pending["job"], pending["sig"], pending["trace"], pending["merged"])
+
+    async def close(self, key: str, sig, trace, job):
+        """Submit a CLOSE, cancelling a pending MODIFY; ``job(sig, trace, cancelled)``."""
+        cancelled = 0
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            pending["handle"].cancel()
+            cancelled = pending["merged"]
+            self.stats["modifies_cancelled"] += cancelled
+            logging.info(f"[COALESCE] {key}: CLOSE cancels {cancelled} pending MODIFY")
+        now = time.monotonic()
+        last = self._closed_at.get(key)
+        if self.window > 0 and last is not None and now - last < self.window:
+            self.stats["closes_dropped"] += 1
+            logging.info(f"[COALESCE] {key}: repeated CLOSE within {self.window * 1000:.0f}ms dropped")
+            return
+        self._closed_at[key] = now
+        await self.queue.submit(key, job, sig, trace, cancelled)
+
+    async def before_open(self, key: str):
+        # A CLOSE after this OPEN targets the new position, never a repeat of an earlier one
+        self._closed_at.pop(key, None)
+        await self.flush(key)
+
+    def saved(self, calls: int):
+        """Record terminal calls the executor did not have to make."""
+        if calls:
+            self.stats["calls_saved"] += calls
+            logging.info(f"[COALESCE] Saved {calls} terminal calls ({self.stats})")
@@ -0,0 +1,162 @@
+import re
+from typing import NamedTuple, Optional
+
+# — Signal phrasings (data) —
+# Each command maps to the ways channels phrase it. Leads are regex fragments written
+# in lowercase and matched against the lowercased message; add a new language or
+# channel style by appending to a list.
+PHRASINGS = {
+    "open_buy":   [r"ich\s+kaufe", r"i\s+buy"],
+    "open_sell":  [r"ich\s+verkaufe", r"i\s+sell"],
+    "close":      [r"ich\s+schließe", r"close"],
+    "set_sl":     [r"ich setze den sl bei"],
+    "set_tp":     [r"ich setze den tp bei"],
+    "state_sl":   [r"sl"],
+    "state_tp":   [r"tp"],
+    "multiplier": [r"maximalen multiplikator"],
+    "put_call":   [r"\bcall\b", r"\bput\b"],
+}
+
+# What follows the lead for each command, matched right after the lead.
+_OPTION = r"(?:\s+(?P<opt>Call|Put)(?:\s*(?P<strike>\d+))?)?"
+BODIES = {
+    "open_buy":   r"\s+(?P<sym>[A-Za-z0-9/._]+)" + _OPTION,
+    "open_sell":  r"\s+(?P<sym>[A-Za-z0-9/._]+)" + _OPTION,
+    "close":      r"\s+(?P<sym>[A-Za-z0-9/.]+)" + _OPTION,
+    "set_sl":     r"\s+(?P<sym>[A-Za-z0-9/.]+)" + _OPTION + r"\sauf\s(?P<price>[\d.]+)",
+    "set_tp":     r"\s+(?P<sym>[A-Za-z0-9/.]+)(?:\s*(?P<opt>Call|Put))?\s*(?:\s*(?P<strike>\d+))?\sauf\s(?P<price>[\d.]+)",
+    "state_sl":   r"[: ]+(?P<price>[\d.]+)",
+    "state_tp":   r"[: ]+(?P<price>[\d.]+)",
+    "multiplier": r"",
+    "put_call":   r"",
+}
+
+# Signal kinds, in the order the handler has always given them priority
+OPEN, CLOSE, MODIFY, STATE, NONE = "open", "close", "modify", "state", "none"
+
+class Signal(NamedTuple):
+    kind: str
+    symbol: Optional[str] = None
+    side: Optional[str] = None        # 'buy'/'sell' as written in the message
+    opt: Optional[str] = None         # 'call'/'put'
+    strike: Optional[float] = None
+    sl: Optional[float] = None
+    tp: Optional[float] = None
+    use_max: bool = False
+    has_put_call: bool = False
+    also: tuple = ()                  # further MODIFYs in the same message (a TP for another symbol)
+
+    @property
+    def action(self) -> Optional[str]:
+        # Buying a PUT is a short position
+        if self.side == "buy" and self.opt == "put":
+            return "sell"
+        return self.side
+
+class SignalGrammar:
+    """Phrasings compiled into one dispatcher. A single scan over the lowercased message
+    finds every lead, including leads that start inside another lead's text; only the
+    command a lead belongs to gets its body matched, anchored right after the lead on the
+    original text. The first successful match per command is kept, exactly as separate
+    searches would have found it."""
+
+    def __init__(self, phrasings: dict = None, bodies: dict = None):
+        phrasings = phrasings or PHRASINGS
+        bodies = {**BODIES, **(bodies or {})}
+        self._leads = []     # (compiled lead, needs word boundary before it, command)
+        self._bodies = {}
+        scan = []
+        for command, command_leads in phrasings.items():
+            self._bodies[command] = re.compile(bodies[command], re.IGNORECASE)
+            for lead in command_leads:
+                # A leading \b would stop re from using its first-character prefilter,
+                # so it is stripped from the scan and checked at the hit instead
+                boundary = lead.startswith(r"\b")
+                lead = lead[2:] if boundary else lead
+                scan.append(lead)
+                self._leads.append((re.compile(lead), boundary, command))
+        # Plain literal-first alternatives: re scans these with a first-character set
+        self.pattern = re.compile("|".join(f"(?:{l})" for l in scan))
+        self._lead_command = {}   # matched lead text -> [(boundary, command), ...]
+
+    def _commands_for(self, lead_text: str) -> list:
+        hit = self._lead_command.get(lead_text)
+        if hit is None:
+            hit = [(b, c) for r, b, c in self._leads if r.fullmatch(lead_text)]
+            self._lead_command[lead_text] = hit
+        return hit
+
+    def scan(self, text: str) -> dict:
+        """First body match per command, as {command: (lead offset, body match)}."""
+        low = text.lower()
+        if len(low) != len(text):
+            # Rare characters change length when lowercased; keep offsets aligned
+            low = "".join(ch if len(ch.lower()) != 1 else ch.lower() for ch in text)
+        found = {}
+        pos = 0
+        # search() from one past each hit rather than finditer(), which would skip leads
+        # starting inside a longer hit
+        while (m := self.pattern.search(low, pos)) is not None:
+            start = pos = m.start()
+            pos += 1
+            for boundary, command in self._commands_for(m.group()):
+                if command in found:
+                    continue
+                if boundary and start and (low[start - 1].isalnum() or low[start - 1] == "_"):
+                    continue
+                b = self._bodies[command].match(text, m.end())
+                if b is not None:
+                    found[command] = (start, b)
+        return found
+
+    def parse(self, text: str) -> Signal:
+        found = self.scan(text)
+        use_max = "multiplier" in found
+        has_put_call = "put_call" in found
+        buy, sell = found.get("open_buy"), found.get("open_sell")
+        if buy or sell:
+            # Both verbs in one message: the first one in the text wins, like trade_re did
+            if buy and (not sell or buy[0] < sell[0]):
+                side, b = "buy", buy[1]
+            else:
+                side, b = "sell", sell[1]
+            return Signal(OPEN, b["sym"], side, _opt(b), _strike(b),
+                          use_max=use_max, has_put_call=has_put_call)
+        if "close" in found:
+            b = found["close"][1]
+            return Signal(CLOSE, b["sym"], None, _opt(b), _strike(b),
+                          use_max=use_max, has_put_call=has_put_call)
+        sl_b, tp_b = found.get("set_sl"), found.get("set_tp")
+        if sl_b or tp_b:
+            sl_b = sl_b and sl_b[1]
+            tp_b = tp_b and tp_b[1]
+            b = sl_b or tp_b
+            also = ()
+            if sl_b and tp_b and tp_b["sym"].upper() != sl_b["sym"].upper():
+                # SL and TP for different symbols: two modifies, as the old cascade made
+                also = (Signal(MODIFY, tp_b["sym"], None, _opt(tp_b), _strike(tp_b), tp=float(tp_b["price"]),
+                               use_max=use_max, has_put_call=has_put_call),)
+                tp_b = None
+            return Signal(MODIFY, b["sym"], None, _opt(b), _strike(b),
+                          sl=float(sl_b["price"]) if sl_b else None,
+                          tp=float(tp_b["price"]) if tp_b else None,
+                          use_max=use_max, has_put_call=has_put_call, also=also)
+        if "state_sl" in found:
+            return Signal(STATE, sl=float(found["state_sl"][1]["price"]),
+                          use_max=use_max, has_put_call=has_put_call)
+        if "state_tp" in found:
+            return Signal(STATE, tp=float(found["state_tp"][1]["price"]),
+                          use_max=use_max, has_put_call=has_put_call)
+        return Signal(NONE, use_max=use_max, has_put_call=has_put_call)
+
+def _opt(b) -> Optional[str]:
+    return b["opt"].lower() if b["opt"] else None
+
+def _strike(b) -> Optional[float]:
+    return float(b["strike"]) if b["strike"] else None
+
+# Compiled once at import; telegram_handler parses every message through this
+GRAMMAR = SignalGrammar()
+
+def parse_signal(text: str) -> Signal:
+    return GRAMMAR.parse(text)
@@ -0,0 +1,101 @@
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+SLOW_WAIT_MS = 250.0   # queue waits above this are logged as warnings
+
+class SignalQueue:
+    """Bounded execution queue between the Telegram loop and blocking MT5 calls.
+
+    Jobs are grouped into one lane per symbol. A lane runs its jobs strictly in
+    submission order on a worker thread; with ``workers`` > 1 different lanes run in
+    parallel, which is only safe when the jobs' terminal calls are serialized (the
+    MetaTrader5 module is not thread-safe; see mt5_gateway). The total
+    number of queued + running jobs is capped at ``maxsize``: ``submit`` waits for a
+    free slot, which pushes back on the handler instead of growing without bound.
+    """
+
+    def __init__(self, maxsize: int = 64, workers: int = 1):
+        self.maxsize = maxsize
+        self._slots = asyncio.Semaphore(maxsize)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="exec")
+        self._lanes: dict = {}        # symbol -> deque of pending jobs
+        self._running: dict = {}      # symbol -> start time of the job in flight
+        self._stats = {"submitted": 0, "done": 0, "failed": 0, "full_waits": 0,
+                       "wait_last_ms": 0.0, "wait_avg_ms": 0.0, "wait_max_ms": 0.0}
+
+    async def submit(self, symbol: str, fn, *args, **kwargs) -> asyncio.Future:
+        """Queue ``fn(*args, **kwargs)`` on the lane for ``symbol``; returns a future
+        with its result (None if the job raised, which is logged). Waits while the
+        queue is full."""
+        if self._slots.locked():
+            self._stats["full_waits"] += 1
+            logging.warning(f"[QUEUE] Full ({self.maxsize}), waiting to queue {symbol}")
+        await self._slots.acquire()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        job = (time.perf_counter(), fut, functools.partial(fn, *args, **kwargs))
+        self._stats["submitted"] += 1
+        lane = self._lanes.get(symbol)
+        if lane is None:
+            self._lanes[symbol] = deque([job])
+            loop.create_task(self._drain(symbol))
+        else:
+            lane.append(job)
+        return fut
+
+    async def _drain(self, symbol: str):
+        lane = self._lanes[symbol]
+        loop = asyncio.get_running_loop()
+        try:
+            while lane:
+                queued_at, fut, call = lane.popleft()
+                started = time.perf_counter()
+                waited = (started - queued_at) * 1000
+                self._record_wait(waited)
+                if waited > SLOW_WAIT_MS:
+                    logging.warning(f"[QUEUE] {symbol} waited {waited:.0f}ms for execution (depth {self.depth()})")
+                self._running[symbol] = started
+                try:
+                    result = await loop.run_in_executor(self._pool, call)
+                    self._stats["done"] += 1
+                    logging.detailed(f"[QUEUE] {symbol}: waited {waited:.1f}ms, "
+                                     f"ran {(time.perf_counter() - started) * 1000:.1f}ms, depth {self.depth()}")
+                    if not fut.cancelled():
+                        fut.set_result(result)
+                except Exception as e:
+                    self._stats["failed"] += 1
+                    logging.error(f"[QUEUE] Job for {symbol} failed: {e}")
+                    if not fut.cancelled():
+                        fut.set_result(None)
+                finally:
+                    self._running.pop(symbol, None)
+                    self._slots.release()
+        finally:
+            del self._lanes[symbol]
+
+    def _record_wait(self, ms: float):
+        s = self._stats
+        s["wait_last_ms"] = ms
+        s["wait_max_ms"] = max(s["wait_max_ms"], ms)
+        # Exponential moving average, roughly the last 20 jobs
+        s["wait_avg_ms"] = ms if s["done"] + s["failed"] == 0 else s["wait_avg_ms"] * 0.95 + ms * 0.05
+
+    def depth(self, symbol: str = None) -> int:
+        """Jobs waiting to start, overall or for one symbol."""
+        if symbol is not None:
+            return len(self._lanes.get(symbol, ()))
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def stats(self) -> dict:
+        now = time.perf_counter()
+        return {
+            **self._stats,
+            "depth": self.depth(),
+            "in_flight": len(self._running),
+            "lanes": {sym: len(lane) for sym, lane in self._lanes.items()},
+            "running_ms": {sym: (now - t) * 1000 for sym, t in self._running.items()},
+        }
@@ -0,0 +1,65 @@
+import re
+import time
+from collections import defaultdict
+
+_WORD = re.compile(r"[A-Z0-9]+")
+
+def words(text: str) -> list:
+    return _WORD.findall(text.upper())
+
+def trigrams(word: str) -> frozenset:
+    """pg_trgm style: the word padded with two spaces in front and one behind."""
+    padded = f"  {word} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+class TrigramIndex:
+    """Approximate string lookup. Entries are (key, text); the query, as a whole and
+    word by word, is scored against each text with the Dice coefficient over
+    trigrams, and the best score per key wins."""
+
+    def __init__(self):
+        self._texts = []                     # entry id -> (key, text, grams)
+        self._postings = defaultdict(list)   # trigram -> entry ids
+
+    def __len__(self):
+        return len(self._texts)
+
+    def add(self, key, text: str):
+        ws = words(text)
+        if not ws:
+            return
+        # Whole text without separators, so 'DAX 40' and 'DAX40' compare equal
+        grams = trigrams("".join(ws))
+        eid = len(self._texts)
+        self._texts.append((key, text, grams))
+        for g in grams:
+            self._postings[g].append(eid)
+
+    def search(self, query: str, limit: int = 5, budget_ms: float = 5.0):
+        """Best ``limit`` (score, key, text) for ``query``, best first, one per key.
+        Stops collecting candidates once ``budget_ms`` is spent and scores what it has.
+        """
+        ws = words(query)
+        if not ws:
+            return []
+        forms = {"".join(ws)} | set(ws)
+        deadline = time.perf_counter() + budget_ms / 1000
+        best = {}                            # key -> (score, text)
+        for form in forms:
+            qgrams = trigrams(form)
+            common = defaultdict(int)
+            for g in qgrams:
+                for eid in self._postings.get(g, ()):
+                    common[eid] += 1
+                if time.perf_counter() > deadline:
+                    break
+            for eid, n in common.items():
+                key, text, grams = self._texts[eid]
+                score = 2.0 * n / (len(qgrams) + len(grams))
+                cur = best.get(key)
+                if cur is None or score > cur[0] or (score == cur[0] and len(text) < len(cur[1])):
+                    best[key] = (score, text)
+            if time.perf_counter() > deadline:
+                break
+        ranked = sorted(((s, k, t) for k, (s, t) in best.items()), key=lambda r: (-r[0], len(r[2])))
+        return ranked[:limit]